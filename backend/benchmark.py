@@ -0,0 +1,284 @@
+"""
+Load-testing benchmark for the StockFlow API.
+
+Boots main:app in process, against a local mongod or an in-memory stand-in
+(mongomock-motor), seeds it and runs scripted scenarios with concurrent clients.
+Results are printed, or written with --output, as JSON with RPS and p50/p95/p99
+latency per endpoint.
+
+Usage:
+    python benchmark.py [--mongo memory|URI] [--items N] [--sales N] [--duration S]
+                        [--concurrency N] [--scenario NAME ...] [--output FILE]
+                        [--baseline FILE] [--tolerance FRACTION]
+
+A run compared with --baseline lists every endpoint whose p95 latency rose or whose
+throughput fell by more than the tolerance, and exits with status 1 if there is any.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from datetime import datetime
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import main
+import seed_data
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "http://benchmark"
+
+# Never the API's own database: the benchmark drops it before seeding
+BENCHMARK_DATABASE = "stockflow_benchmark"
+
+# Items that take most of the point-of-sale traffic
+HOT_ITEMS = 10
+
+class Recorder:
+    """Latency samples per endpoint for one scenario"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    async def request(self, client, method, url, label=None, **kwargs):
+        label = label or f"{method} {url.split('?')[0]}"
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples.setdefault(label, []).append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for label, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        endpoints[label] = {
+            "requests": len(ordered),
+            "errors": recorder.errors.get(label, 0),
+            "rps": round(len(ordered) / elapsed, 1),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        }
+    total = sum(len(samples) for samples in recorder.samples.values())
+    return {"duration_s": round(elapsed, 2), "requests": total, "rps": round(total / elapsed, 1), "endpoints": endpoints}
+
+# Scenarios: each worker of a scenario calls step(client, recorder, state, rng) in a
+# loop until the scenario's time is up
+async def dashboard_step(client, recorder, state, rng):
+    """Read mix of a back office with dashboards open"""
+    roll = rng.random()
+    if roll < 0.5:
+        await recorder.request(client, "GET", "/api/dashboard")
+    elif roll < 0.7:
+        await recorder.request(client, "GET", "/api/lowstock?limit=100")
+    elif roll < 0.9:
+        await recorder.request(client, "GET", "/api/sales/monthly")
+    else:
+        await recorder.request(client, "GET", "/api/items?limit=50")
+
+async def pos_step(client, recorder, state, rng):
+    """Single-line sales against a handful of hot items, as tills do at peak"""
+    item_id = rng.choice(state["hot_items"])
+    await recorder.request(client, "POST", "/api/sales", json={"itemId": item_id, "quantity": 1})
+
+async def paging_step(client, recorder, state, rng):
+    """Walk the item and sales listings page by page, starting over at the end"""
+    path = rng.choice(["/api/items", "/api/sales"])
+    cursors = state.setdefault("cursors", {})
+    url = f"{path}?limit=100"
+    if cursors.get(path):
+        url += f"&after={cursors[path]}"
+    response = await recorder.request(client, "GET", url, label=f"GET {path} (paged)")
+    cursors[path] = response.headers.get("X-Next-Cursor")
+
+async def search_step(client, recorder, state, rng):
+    """Picker lookups as a till operator types: typeahead on a growing prefix, then a search"""
+    name = rng.choice(state["item_keys"])[0].lower()
+    for length in range(1, min(len(name), 4) + 1):
+        await recorder.request(client, "GET", "/api/items/typeahead", params={"q": name[:length]})
+    await recorder.request(client, "GET", "/api/items", params={"q": name.split()[0], "sort": "name", "limit": 50})
+
+async def receiving_step(client, recorder, state, rng):
+    """Goods receipt: an NDJSON import of restocked and new items"""
+    rows = []
+    for _ in range(state["receiving_rows"]):
+        if rng.random() < 0.8 and state["item_keys"]:
+            name, brand, item_type = rng.choice(state["item_keys"])
+        else:
+            state["new_items"] += 1
+            name, brand, item_type = f"Received {state['worker']}-{state['new_items']}", "Benchmark", "Home"
+        rows.append({
+            "name": name, "brand": brand, "type": item_type,
+            "quantity": rng.randint(1, 50), "lowStockThreshold": 10
+        })
+    body = "\n".join(json.dumps(row) for row in rows)
+    await recorder.request(
+        client, "POST", "/api/items/import?format=ndjson",
+        content=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+
+# name: (step, description)
+SCENARIOS = {
+    "dashboard": (dashboard_step, "dashboard-heavy read mix"),
+    "pos": (pos_step, "burst of POST /api/sales against hot items"),
+    "paging": (paging_step, "cursor paging through items and sales"),
+    "search": (search_step, "item typeahead and search as a picker uses them"),
+    "receiving": (receiving_step, "bulk receiving through /api/items/import"),
+}
+
+async def seed(args):
+    """Drop the benchmark database and fill it with args.items/sales/cashflows documents"""
+    await main.client.drop_database(main.DATABASE_NAME)
+    random.seed(args.seed)
+    items = seed_data.generate_items(args.items)
+    await main.db.items.insert_many(items)
+    # Hot items get enough stock for any POS burst
+    hot_ids = [item["_id"] for item in items[:HOT_ITEMS]]
+    await main.db.items.update_many({"_id": {"$in": hot_ids}}, {"$set": {"quantity": 10_000_000}})
+
+    item_types = {str(item["_id"]): item["type"] for item in items}
+    for start in range(0, args.sales, args.batch_size):
+        sales = seed_data.generate_sales(items, min(args.batch_size, args.sales - start))
+        await main.db.sales.insert_many(sales)
+        await main.update_sales_rollup(sales, item_types)
+    await main.db.cashflows.insert_many(seed_data.generate_cashflows(args.cashflows))
+
+    await main.ensure_indexes()
+    await main.backfill_low_stock_flags()
+    await main.backfill_search_terms()
+    await main.reconcile_stats()
+    return {
+        "hot_items": [str(item_id) for item_id in hot_ids],
+        "item_keys": [(item["name"], item["brand"], item["type"]) for item in items],
+        "receiving_rows": args.receiving_rows,
+        "new_items": 0,
+    }
+
+async def run_scenario(name, client, state, args):
+    step = SCENARIOS[name][0]
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(index):
+        rng = random.Random(f"{args.seed}-{name}-{index}")
+        worker_state = dict(state, worker=index)
+        while time.perf_counter() < deadline:
+            await step(client, recorder, worker_state, rng)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(args.concurrency)))
+    result = summarize(recorder, time.perf_counter() - started)
+    logger.info(f"{name}: {result['requests']} requests, {result['rps']} req/s")
+    return result
+
+def compare(report, baseline, tolerance):
+    """Endpoints that got slower (p95) or slower to serve (RPS) than the baseline by more than tolerance"""
+    regressions = []
+    for name, scenario in report["scenarios"].items():
+        base_endpoints = baseline.get("scenarios", {}).get(name, {}).get("endpoints", {})
+        for label, current in scenario["endpoints"].items():
+            base = base_endpoints.get(label)
+            if not base:
+                continue
+            if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append({"scenario": name, "endpoint": label, "metric": "p95_ms",
+                                    "baseline": base["p95_ms"], "current": current["p95_ms"]})
+            if current["rps"] < base["rps"] * (1 - tolerance):
+                regressions.append({"scenario": name, "endpoint": label, "metric": "rps",
+                                    "baseline": base["rps"], "current": current["rps"]})
+    return regressions
+
+async def connect(args):
+    if args.mongo == "memory":
+        # Only needed for in-memory runs, so imported here
+        from mongomock_motor import AsyncMongoMockClient
+        main.client = AsyncMongoMockClient()
+    else:
+        main.client = AsyncIOMotorClient(args.mongo, **main.mongo_client_options())
+        await main.client.server_info()
+        main.transactions_enabled = await main.detect_transaction_support()
+    main.DATABASE_NAME = args.database
+    main.db = main.analytics_db = main.client[args.database]
+
+async def run(args):
+    await connect(args)
+    try:
+        logger.info(f"Seeding {args.items} items, {args.sales} sales and {args.cashflows} cash flows")
+        state = await seed(args)
+        report = {
+            "meta": {
+                "startedAt": datetime.now().isoformat(timespec="seconds"),
+                "mongo": "memory" if args.mongo == "memory" else "mongod",
+                "items": args.items, "sales": args.sales, "cashflows": args.cashflows,
+                "duration_s": args.duration, "concurrency": args.concurrency, "seed": args.seed,
+                "responseCacheTtl": main.response_cache.ttl, "fastJson": main.FAST_JSON,
+            },
+            "scenarios": {},
+        }
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url=BASE_URL, timeout=60) as client:
+            for name in args.scenario:
+                report["scenarios"][name] = await run_scenario(name, client, state, args)
+    finally:
+        main.client.close()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.tolerance)
+        for regression in report["regressions"]:
+            logger.warning(
+                f"Regression in {regression['scenario']} {regression['endpoint']}: {regression['metric']} "
+                f"{regression['baseline']} -> {regression['current']}"
+            )
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="StockFlow API benchmark")
+    parser.add_argument("--mongo", default="memory", help="'memory' for the in-memory stand-in or a MongoDB URI")
+    parser.add_argument("--database", default=BENCHMARK_DATABASE, help="database to (re)create for the run")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--sales", type=int, default=20000)
+    parser.add_argument("--cashflows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=5000, help="documents per insert while seeding")
+    parser.add_argument(
+        "--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS),
+        help="; ".join(f"{name}: {description}" for name, (_, description) in SCENARIOS.items())
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients per scenario")
+    parser.add_argument("--receiving-rows", type=int, default=200, help="rows per import in the receiving scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change before flagging")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    # The API logs every request at INFO; writing those lines would dominate the numbers
+    logging.getLogger("main").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(1 if report.get("regressions") else 0)
@@ -0,0 +1,229 @@
+"""
+HTTP caching for the read-heavy GET routes.
+
+ResponseCache keeps responses in process, whole (status, headers and body), keyed by
+path, query string and ETag and tagged with the collections they were read from. Write
+routes invalidate by collection, and every entry also expires after a short TTL, which
+bounds staleness of the routes without an ETag.
+
+ConditionalGetMiddleware derives ETags from per-collection version counters shared by
+all processes, and answers If-None-Match with 304 before any query runs. As the ETag is
+part of the cache key, a write by another process makes the next request miss the cache.
+
+MemoCache keeps computed results, such as reports, under keys that include those
+version counters.
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import date
+from urllib.parse import urlencode
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """Size-bounded LRU of rendered responses with a TTL"""
+
+    def __init__(self, max_entries=256, ttl=5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, tags, status, headers, body)
+        # Bumped on every invalidation of a tag; a response whose tags changed while it
+        # was being computed may already be stale and is not stored
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def snapshot(self, tags):
+        return tuple(self.generations.get(tag, 0) for tag in tags)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2:]
+
+    def set(self, key, tags, generations, status, headers, body):
+        if self.snapshot(tags) != generations:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, tags, status, headers, body)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *tags):
+        """Drop every cached response read from any of the given collections"""
+        for tag in tags:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+        stale = [key for key, entry in self.entries.items() if not entry[1].isdisjoint(tags)]
+        for key in stale:
+            del self.entries[key]
+        self.invalidations += len(stale)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "maxEntries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+def cache_key(request):
+    query = urlencode(sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+def request_etag(request):
+    """ETag ConditionalGetMiddleware assigned to the request, if any"""
+    return request.scope.get("state", {}).get("etag")
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """Serve GET requests for the configured routes from a ResponseCache.
+
+    routes maps a path to the collections its response is read from. Runs inside
+    ConditionalGetMiddleware: a response is only served to requests with the ETag it
+    was stored under, so it is never sent with the ETag of newer data.
+    """
+
+    def __init__(self, app, cache, routes):
+        super().__init__(app)
+        self.cache = cache
+        self.routes = {path: frozenset(tags) for path, tags in routes.items()}
+
+    async def dispatch(self, request, call_next):
+        tags = self.routes.get(request.url.path)
+        if request.method != "GET" or tags is None or not self.cache.enabled:
+            return await call_next(request)
+
+        key = (cache_key(request), request_etag(request))
+        cached = self.cache.get(key)
+        if cached is not None:
+            status, headers, body = cached
+            response = Response(content=body, status_code=status, headers=headers)
+            response.headers["X-Cache"] = "HIT"
+            return response
+
+        generations = self.cache.snapshot(tags)
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        headers = dict(response.headers)
+        if response.status_code == 200:
+            self.cache.set(key, tags, generations, response.status_code, headers, body)
+        response = Response(content=body, status_code=response.status_code, headers=headers)
+        response.headers["X-Cache"] = "MISS"
+        return response
+
+def make_etag(request, tags, state, today=None):
+    versions = state.get("versions", {})
+    parts = [str(state.get("epoch", "")), cache_key(request), str(today or "")]
+    parts += [f"{tag}={versions.get(tag, 0)}" for tag in sorted(tags)]
+    digest = hashlib.sha1("|".join(parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+def etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(token.strip().removeprefix("W/") == opaque for token in header.split(","))
+
+class ConditionalGetMiddleware(BaseHTTPMiddleware):
+    """Add ETags to GET responses of the configured routes and answer 304 when unchanged.
+
+    routes maps a path to the collections its response is read from; load_versions is
+    a coroutine function returning {"epoch": ..., "versions": {collection: n}}. exclude
+    returns the paths to leave without ETags, such as routes reading from secondaries,
+    whose data may be older than the versions. The ETags of the dated paths, whose
+    default ranges end today, change at midnight too.
+    """
+
+    def __init__(self, app, routes, load_versions, exclude=lambda: (), dated=()):
+        super().__init__(app)
+        self.routes = {path: frozenset(tags) for path, tags in routes.items()}
+        self.load_versions = load_versions
+        self.exclude = exclude
+        self.dated = frozenset(dated)
+
+    async def dispatch(self, request, call_next):
+        tags = self.routes.get(request.url.path)
+        if request.method != "GET" or tags is None or request.url.path in self.exclude():
+            return await call_next(request)
+
+        try:
+            # Read before the route runs: if a write lands in between, the response is
+            # newer than its ETag, which only costs the client one more full fetch
+            today = date.today() if request.url.path in self.dated else None
+            etag = make_etag(request, tags, await self.load_versions(), today)
+        except Exception as e:
+            logger.error(f"Could not load collection versions for ETag: {e}")
+            return await call_next(request)
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        request.state.etag = etag
+        response = await call_next(request)
+        if response.status_code == 200:
+            response.headers["ETag"] = etag
+        return response
+
+class MemoCache:
+    """Size-bounded LRU of computed results.
+
+    Keys are expected to embed the versions of the data a result was computed from, so
+    a stale entry is simply never looked up again; entries are evicted, not invalidated.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.entries[key]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "maxEntries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,67 @@
+"""
+In-process publish/subscribe for the server-sent events stream.
+
+Write routes publish events to an EventBus; every client connected to the SSE route
+holds a bounded queue on it. A client that stops reading loses its oldest events
+instead of slowing down the writers.
+"""
+
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EventBus:
+    """Fan out events to subscriber queues without ever blocking the publisher"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event_type, data):
+        self.published += 1
+        for queue in list(self.subscribers):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait((event_type, data))
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+def format_sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def sse_stream(bus, request, heartbeat=15.0):
+    """Relay events from the bus to one client until it disconnects.
+
+    A comment line is sent after heartbeat seconds of silence, which keeps proxies
+    from closing the connection and notices clients that went away.
+    """
+    queue = bus.subscribe()
+    try:
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            try:
+                event_type, data = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event_type, data)
+    finally:
+        bus.unsubscribe(queue)
@@ -1,17 +1,39 @@
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Literal, Optional, Union
+from datetime import date, datetime, timedelta
 import os
-from bson import ObjectId
+from bson import ObjectId, json_util
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+import base64
+import bisect
+import codecs
+import csv
+import io
+import json
+import re
 from fastapi.encoders import jsonable_encoder
 import logging
 import asyncio
+import time
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # optional, speeds up the FAST_JSON list responses
+    orjson = None
+
+from cache import ConditionalGetMiddleware, MemoCache, ResponseCache, ResponseCacheMiddleware
+from events import EventBus, sse_stream
+from forecast import Forecaster
+from metrics import MetricsMiddleware, mongo_listeners, pool_metrics, render_metrics
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,6 +44,67 @@ load_dotenv()
 # Initialize FastAPI app
 app = FastAPI(title="StockFlow API")
 
+# Short-lived response cache for the read-heavy routes. RESPONSE_CACHE_TTL=0 disables it
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "5"))
+)
+
+# Cached GET routes and the collections their responses are read from. The same table
+# drives their ETags, which change whenever one of those collections is written
+CACHED_ROUTES = {
+    "/api/items": ("items",),
+    "/api/items/typeahead": ("items",),
+    "/api/sales": ("sales",),
+    "/api/sales/monthly": ("sales",),
+    "/api/cashflows": ("cashflows",),
+    "/api/cashflows/balance": ("cashflows",),
+    "/api/cashflows/balance/series": ("cashflows",),
+    "/api/lowstock": ("items",),
+    "/api/dashboard": ("items", "sales", "cashflows"),
+    "/api/reports/top-items": ("sales",),
+    "/api/reports/revenue-by-type": ("items", "sales"),
+    "/api/reports/comparison": ("sales",),
+    "/api/reports/turnover": ("items", "sales"),
+}
+
+# Cached routes reading through analytics_db. With a secondary read preference their
+# data may lag the versions, which are read from the primary, so they get no ETag
+ANALYTICS_ROUTES = {
+    "/api/sales/monthly",
+    "/api/cashflows/balance",
+    "/api/cashflows/balance/series",
+    "/api/dashboard",
+    "/api/reports/top-items",
+    "/api/reports/revenue-by-type",
+    "/api/reports/comparison",
+    "/api/reports/turnover",
+}
+
+# Cached routes whose default range ends today, so their responses change at midnight
+# without any write
+DATED_ROUTES = {
+    "/api/sales/monthly",
+    "/api/cashflows/balance/series",
+    "/api/dashboard",
+    "/api/reports/top-items",
+    "/api/reports/revenue-by-type",
+    "/api/reports/comparison",
+    "/api/reports/turnover",
+}
+
+# Computed reports, keyed by report, parameters and the versions of the collections read
+report_cache = MemoCache(max_entries=int(os.getenv("REPORT_CACHE_SIZE", "128")))
+
+# Added before CORS so they run inside it and cached and 304 responses still get CORS
+# headers. The ETag check runs first, so a client that is up to date costs one version read
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache, routes=CACHED_ROUTES)
+app.add_middleware(
+    ConditionalGetMiddleware, routes=CACHED_ROUTES, load_versions=lambda: load_versions(),
+    exclude=lambda: ANALYTICS_ROUTES if ANALYTICS_READ_PREFERENCE != "primary" else (),
+    dated=DATED_ROUTES
+)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -29,52 +112,266 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "X-Cache", "ETag"],
 )
 
+# Outermost, so the latency histograms include every other middleware
+app.add_middleware(MetricsMiddleware)
+
 # MongoDB connection
 MONGODB_URI = os.getenv("MONGODB_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "stockflow")
 
+def env_flag(name, default=False):
+    """Read a boolean feature flag from the environment"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Debug mode adds diagnostics such as Server-Timing headers to responses
+DEBUG = env_flag("DEBUG")
+
+# Run explain on every route's query shape at startup and report collection scans
+INDEX_AUDIT = env_flag("INDEX_AUDIT")
+
+# Connection pool and wire compression of the MongoDB client. Compressors are a comma
+# separated preference list such as "zstd,snappy,zlib"; the server picks one it supports
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "").strip()
+# Connections opened at startup so the first requests don't pay for the handshakes
+MONGODB_WARMUP_CONNECTIONS = int(os.getenv("MONGODB_WARMUP_CONNECTIONS", str(MONGODB_MIN_POOL_SIZE)))
+
+# Read preference of the analytics reads (dashboard charts, monthly sales, exports,
+# reports), e.g. secondaryPreferred to keep them off the primary that takes the sales
+ANALYTICS_READ_PREFERENCE = os.getenv("ANALYTICS_READ_PREFERENCE", "primary").strip()
+
+# Multi-document transactions: "auto" enables them when connected to a replica set or mongos
+MONGODB_TRANSACTIONS = os.getenv("MONGODB_TRANSACTIONS", "auto").strip().lower()
+
+# Mock unit price used to compute sale totals
+SALE_UNIT_PRICE = 19.99
+
+# Maximum number of lines accepted by POST /api/sales/batch, and how many of its stock
+# decrements may be in flight at once: a share of the pool, so that a large batch
+# doesn't queue every other request behind it for a connection
+MAX_SALE_BATCH = 1000
+SALE_BATCH_CONCURRENCY = max(1, MONGODB_MAX_POOL_SIZE // 4)
+
+# Rows per bulk_write in POST /api/items/import, and how many row errors the summary lists
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+MAX_IMPORT_ERRORS = 100
+
+# Cursor batch size for the export routes; each batch is encoded and sent as one chunk
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+# Where /api/events gets its events: "local" publishes from this process's write routes,
+# "changestream" tails MongoDB change streams (replica set only) and so also sees
+# writes made by other API processes
+EVENTS_SOURCE = os.getenv("EVENTS_SOURCE", "local").strip().lower()
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+
+# Opt-in fast path for the list routes: documents are shaped by the database ($project
+# with id as a string) and encoded as-is, skipping fix_id and response_model validation.
+# Requests with ?fields= always take it
+FAST_JSON = env_flag("FAST_JSON")
+
+# Insert sample documents into empty collections at startup; off so cold starts stay fast
+SEED_SAMPLE_DATA = env_flag("SEED_SAMPLE_DATA")
+
+# Seconds between refreshes of the document counts reported by the readiness check
+HEALTH_REFRESH_INTERVAL = float(os.getenv("HEALTH_REFRESH_INTERVAL", "30"))
+
+# Sales older than this many days are moved out of sales into per-item per-day buckets
+# in sales_archive, every SALES_ARCHIVE_INTERVAL seconds; 0 keeps every sale in sales
+SALES_ARCHIVE_DAYS = int(os.getenv("SALES_ARCHIVE_DAYS", "0"))
+SALES_ARCHIVE_INTERVAL = float(os.getenv("SALES_ARCHIVE_INTERVAL", "3600"))
+# WiredTiger block compressor of sales_archive when the API creates it
+SALES_ARCHIVE_COMPRESSOR = os.getenv("SALES_ARCHIVE_COMPRESSOR", "zstd").strip()
+
+# Cash balance snapshots are taken at the start of every day or month, by a background
+# task that catches up every CASH_SNAPSHOT_INTERVAL seconds
+CASH_SNAPSHOT_PERIOD = os.getenv("CASH_SNAPSHOT_PERIOD", "day").strip().lower()
+CASH_SNAPSHOT_INTERVAL = float(os.getenv("CASH_SNAPSHOT_INTERVAL", "3600"))
+
+# Demand forecasts of every item, recomputed every FORECAST_INTERVAL seconds from the
+# last FORECAST_HISTORY_DAYS days of sales: "exponential" smoothing or "moving-average".
+# Reorder suggestions cover the supplier lead time plus FORECAST_COVER_DAYS of demand
+FORECAST_METHOD = os.getenv("FORECAST_METHOD", "exponential").strip().lower()
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "365"))
+FORECAST_LEAD_DAYS = int(os.getenv("FORECAST_LEAD_DAYS", "7"))
+FORECAST_COVER_DAYS = int(os.getenv("FORECAST_COVER_DAYS", "30"))
+FORECAST_INTERVAL = float(os.getenv("FORECAST_INTERVAL", "3600"))
+
+# Page size limits for the list routes
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 1000
+
+# Item search: longest query accepted, words of it matched, and typeahead result limits
+MAX_SEARCH_LENGTH = 100
+MAX_SEARCH_WORDS = 5
+DEFAULT_TYPEAHEAD_SIZE = 10
+MAX_TYPEAHEAD_SIZE = 50
+
 # Create motor client
 client = None
 db = None
+# Same database, read with ANALYTICS_READ_PREFERENCE
+analytics_db = None
+transactions_enabled = False
+
+# Server-sent events published by the write routes or the change stream watcher
+event_bus = EventBus(queue_size=EVENTS_QUEUE_SIZE)
+change_stream_task = None
+
+# Readiness state, refreshed in the background by refresh_health so probes never query
+health_state = {"collections": {}, "checkedAt": None, "refreshed": None, "error": None}
+health_task = None
+
+# Moves old sales to sales_archive when SALES_ARCHIVE_DAYS is set
+archive_task = None
+# Writes the cash balance snapshots
+snapshot_task = None
+
+# Latest demand forecast, recomputed by forecast_task
+forecaster = Forecaster(
+    history_days=FORECAST_HISTORY_DAYS, method=FORECAST_METHOD,
+    lead_days=FORECAST_LEAD_DAYS, cover_days=FORECAST_COVER_DAYS
+)
+forecast_task = None
 
 @app.on_event("startup")
 async def startup_db_client():
-    global client, db
+    global client, db, analytics_db, transactions_enabled, change_stream_task, health_task, archive_task, snapshot_task, forecast_task
     logger.info(f"Connecting to MongoDB: {MONGODB_URI}")
     
     try:
         # Create a test client connection to verify
-        client = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
+        client = AsyncIOMotorClient(MONGODB_URI, **mongo_client_options())
         # Force a connection to verify
         await client.server_info()
         logger.info("Successfully connected to MongoDB")
         
         db = client[DATABASE_NAME]
-        logger.info(f"Using database: {DATABASE_NAME}")
+        analytics_db = client.get_database(
+            DATABASE_NAME,
+            read_preference=make_read_preference(read_pref_mode_from_name(ANALYTICS_READ_PREFERENCE), None)
+        )
+        logger.info(f"Using database: {DATABASE_NAME} (analytics reads: {ANALYTICS_READ_PREFERENCE})")
+        
+        transactions_enabled, _, _ = await asyncio.gather(
+            detect_transaction_support(),
+            initialize_collections(),
+            warm_up_pool(MONGODB_WARMUP_CONNECTIONS)
+        )
+        logger.info(f"Multi-document transactions enabled: {transactions_enabled}")
         
-        # Initialize collections
-        await initialize_collections()
+        health_task = asyncio.create_task(refresh_health())
+        snapshot_task = asyncio.create_task(run_cash_snapshots())
+        forecast_task = asyncio.create_task(run_forecasts())
+        if EVENTS_SOURCE == "changestream":
+            change_stream_task = asyncio.create_task(watch_change_streams())
+        if SALES_ARCHIVE_DAYS > 0:
+            archive_task = asyncio.create_task(run_sales_archiver())
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         raise e
 
+def mongo_client_options():
+    """Keyword arguments for AsyncIOMotorClient from the pool configuration"""
+    options = {
+        "serverSelectionTimeoutMS": 5000,
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "event_listeners": mongo_listeners()
+    }
+    if MONGODB_COMPRESSORS:
+        options["compressors"] = MONGODB_COMPRESSORS
+    return options
+
+async def warm_up_pool(connections):
+    """Open connections ahead of traffic: concurrent pings each need a connection of their own"""
+    if connections > 0:
+        await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
+        logger.info(f"Warmed up {connections} MongoDB connections")
+
+async def detect_transaction_support():
+    """Transactions need a replica set or a sharded cluster; standalone servers reject them"""
+    if MONGODB_TRANSACTIONS in ("0", "false", "no", "off"):
+        return False
+    if MONGODB_TRANSACTIONS in ("1", "true", "yes", "on"):
+        return True
+    hello = await client.admin.command("hello")
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+async def in_transaction(write):
+    """Await write(session) in a transaction when transactions are enabled, otherwise write(None).
+
+    Every write that takes session as its session= argument commits or aborts together;
+    None runs the writes independently. A transaction failing with a transient error,
+    such as a write conflict with a concurrent sale of the same item, or with an unknown
+    commit result is run again by with_transaction, so write must be safe to repeat.
+    """
+    if not transactions_enabled:
+        return await write(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(write)
+
 async def initialize_collections():
-    """Initialize collections and add sample data if they're empty"""
+    """Create missing collections and indexes and build any derived data the database lacks.
+
+    Independent steps run concurrently to keep cold starts short. Sample data is only
+    added with SEED_SAMPLE_DATA.
+    """
     logger.info("Checking and initializing collections")
     
     # List existing collections
     collections = await db.list_collection_names()
     logger.info(f"Existing collections: {collections}")
+    missing = [name for name in ("items", "sales", "cashflows") if name not in collections]
+    if missing:
+        logger.info(f"Creating collections: {missing}")
+        await asyncio.gather(*(db.create_collection(name) for name in missing))
+    if SALES_ARCHIVE_DAYS > 0 and "sales_archive" not in collections:
+        await create_sales_archive()
+    
+    if SEED_SAMPLE_DATA:
+        await seed_sample_data()
     
-    # Initialize items collection
-    if "items" not in collections:
-        logger.info("Creating items collection")
-        await db.create_collection("items")
+    stats, rollup_months, any_sale, _ = await asyncio.gather(
+        db["stats"].find_one({"_id": STATS_ID}, {"reconciled": 1, "lowStockFlags": 1, "searchTerms": 1}),
+        db.sales_monthly.estimated_document_count(),
+        db.sales.find_one({}, {"_id": 1}),
+        ensure_indexes()
+    )
+    stats = stats or {}
+    backfills = []
+    # Build the dashboard counters on first start
+    if not stats.get("reconciled"):
+        logger.info("Building dashboard stats counters")
+        backfills.append(reconcile_stats())
+    # Flag low items once for a database that predates the isLow field
+    if not stats.get("lowStockFlags"):
+        logger.info("Backfilling low stock flags")
+        backfills.append(backfill_low_stock_flags())
+    # Index the words of item names and brands once for a database that predates search
+    if not stats.get("searchTerms"):
+        logger.info("Backfilling item search terms")
+        backfills.append(backfill_search_terms())
+    # Build the monthly rollup once for a database that predates it
+    if rollup_months == 0 and any_sale:
+        logger.info("Backfilling monthly sales rollup")
+        backfills.append(rebuild_sales_rollup())
+    await asyncio.gather(*backfills)
     
+    if INDEX_AUDIT:
+        await audit_indexes()
+
+async def seed_sample_data():
+    """Add a few sample documents to each empty collection"""
     # Add sample items if empty
-    if await db.items.count_documents({}) == 0:
+    if not await db.items.find_one({}, {"_id": 1}):
         logger.info("Adding sample items")
         sample_items = [
             {
@@ -83,8 +380,8 @@ async def initialize_collections():
                 "type": "Clothing",
                 "quantity": 50,
                 "lowStockThreshold": 10,
-                "createdAt": datetime.now().isoformat(),
-                "updatedAt": datetime.now().isoformat()
+                "createdAt": datetime.now(),
+                "updatedAt": datetime.now()
             },
             {
                 "name": "Jeans",
@@ -92,8 +389,8 @@ async def initialize_collections():
                 "type": "Clothing",
                 "quantity": 5,
                 "lowStockThreshold": 8,
-                "createdAt": datetime.now().isoformat(),
-                "updatedAt": datetime.now().isoformat()
+                "createdAt": datetime.now(),
+                "updatedAt": datetime.now()
             },
             {
                 "name": "Sunglasses",
@@ -101,8 +398,8 @@ async def initialize_collections():
                 "type": "Accessories",
                 "quantity": 15,
                 "lowStockThreshold": 5,
-                "createdAt": datetime.now().isoformat(),
-                "updatedAt": datetime.now().isoformat()
+                "createdAt": datetime.now(),
+                "updatedAt": datetime.now()
             },
             {
                 "name": "Sneakers",
@@ -110,8 +407,8 @@ async def initialize_collections():
                 "type": "Footwear",
                 "quantity": 20,
                 "lowStockThreshold": 7,
-                "createdAt": datetime.now().isoformat(),
-                "updatedAt": datetime.now().isoformat()
+                "createdAt": datetime.now(),
+                "updatedAt": datetime.now()
             },
             {
                 "name": "Watch",
@@ -119,20 +416,18 @@ async def initialize_collections():
                 "type": "Accessories",
                 "quantity": 8,
                 "lowStockThreshold": 10,
-                "createdAt": datetime.now().isoformat(),
-                "updatedAt": datetime.now().isoformat()
+                "createdAt": datetime.now(),
+                "updatedAt": datetime.now()
             }
         ]
+        for item in sample_items:
+            item["searchTerms"] = search_terms(item["name"], item["brand"])
         result = await db.items.insert_many(sample_items)
+        await db.items.update_many({}, [LOW_STOCK_FIELDS])
         logger.info(f"Inserted {len(result.inserted_ids)} sample items")
     
-    # Initialize sales collection
-    if "sales" not in collections:
-        logger.info("Creating sales collection")
-        await db.create_collection("sales")
-    
     # Add sample sales if empty
-    if await db.sales.count_documents({}) == 0:
+    if not await db.sales.find_one({}, {"_id": 1}):
         logger.info("Adding sample sales")
         
         # Get some item IDs to reference
@@ -151,59 +446,157 @@ async def initialize_collections():
                         "itemName": item["name"],
                         "quantity": j + 1,
                         "total": (j + 1) * 19.99,
-                        "saleDate": sale_date.isoformat()
+                        "saleDate": sale_date
                     })
             
             if sample_sales:
                 result = await db.sales.insert_many(sample_sales)
                 logger.info(f"Inserted {len(result.inserted_ids)} sample sales")
     
-    # Initialize cashflows collection
-    if "cashflows" not in collections:
-        logger.info("Creating cashflows collection")
-        await db.create_collection("cashflows")
-    
     # Add sample cashflows if empty
-    if await db.cashflows.count_documents({}) == 0:
+    if not await db.cashflows.find_one({}, {"_id": 1}):
         logger.info("Adding sample cashflows")
         sample_cashflows = [
             {
                 "description": "Initial investment",
                 "amount": 5000.00,
                 "isInflow": True,
-                "date": datetime.now().isoformat()
+                "date": datetime.now()
             },
             {
                 "description": "Rent payment",
                 "amount": 1200.00,
                 "isInflow": False,
-                "date": datetime.now().isoformat()
+                "date": datetime.now()
             },
             {
                 "description": "Sales revenue",
                 "amount": 3500.00,
                 "isInflow": True,
-                "date": datetime.now().isoformat()
+                "date": datetime.now()
             },
             {
                 "description": "Utilities",
                 "amount": 350.00,
                 "isInflow": False,
-                "date": datetime.now().isoformat()
+                "date": datetime.now()
             },
             {
                 "description": "Online orders",
                 "amount": 2200.00,
                 "isInflow": True,
-                "date": datetime.now().isoformat()
+                "date": datetime.now()
             }
         ]
         result = await db.cashflows.insert_many(sample_cashflows)
         logger.info(f"Inserted {len(result.inserted_ids)} sample cashflows")
 
+# Index definitions, applied idempotently at startup: (collection, keys, options)
+INDEX_SPEC = [
+    # add_item merges on name/brand/type, so the key must be unique
+    ("items", [("name", 1), ("brand", 1), ("type", 1)], {"name": "name_brand_type", "unique": True}),
+    # Listing order of get_sales, _id breaks ties for cursors
+    ("sales", [("saleDate", -1), ("_id", -1)], {"name": "saleDate_desc"}),
+    ("sales", [("itemId", 1)], {"name": "itemId"}),
+    # Listing order of get_cash_flows
+    ("cashflows", [("date", -1), ("_id", -1)], {"name": "date_desc"}),
+    # Rollup upsert key, also serves month-range reads for one item or for the month totals
+    ("sales_monthly", [("itemId", 1), ("month", 1)], {"name": "itemId_month", "unique": True}),
+    ("sales_monthly", [("type", 1), ("month", 1)], {"name": "type_month"}),
+    # One archive bucket per item and day; the archiver relies on the key being unique
+    ("sales_archive", [("itemId", 1), ("day", 1)], {"name": "itemId_day", "unique": True}),
+    ("sales_archive", [("day", -1)], {"name": "day_desc"}),
+    # Only low items are indexed, in get_low_stock_items order; also serves isLow counts
+    ("items", [("lowStockRatio", 1), ("_id", 1)], {"name": "low_stock", "partialFilterExpression": {"isLow": True}}),
+    # Item search: word prefixes of name and brand, full-text matches, and the sort
+    # orders of get_items, alone or under a type or brand filter
+    ("items", [("searchTerms", 1)], {"name": "search_terms"}),
+    ("items", [("name", "text"), ("brand", "text")], {"name": "name_brand_text", "weights": {"name": 3, "brand": 1}}),
+    ("items", [("name", 1), ("_id", 1)], {"name": "name"}),
+    ("items", [("quantity", 1), ("_id", 1)], {"name": "quantity"}),
+    ("items", [("type", 1), ("name", 1), ("_id", 1)], {"name": "type_name"}),
+    ("items", [("brand", 1), ("name", 1), ("_id", 1)], {"name": "brand_name"}),
+]
+
+# Query shapes issued by the routes, checked by audit_indexes: (label, collection, command)
+QUERY_SHAPES = [
+    ("add_item lookup", "items", {"find": "items", "filter": {"name": "", "brand": "", "type": ""}, "limit": 1}),
+    ("get_items", "items", {"find": "items", "filter": {}, "sort": {"_id": 1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_items by name", "items", {"find": "items", "filter": {}, "sort": {"name": 1, "_id": 1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_items by quantity", "items", {"find": "items", "filter": {}, "sort": {"quantity": -1, "_id": -1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_items type filter", "items", {"find": "items", "filter": {"type": ""}, "sort": {"name": 1, "_id": 1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_items brand filter", "items", {"find": "items", "filter": {"brand": ""}, "sort": {"name": 1, "_id": 1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_items prefix search", "items", {"find": "items", "filter": {"searchTerms": re.compile("^a")}, "sort": {"_id": 1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_items text search", "items", {"find": "items", "filter": {"$text": {"$search": "a"}}, "limit": DEFAULT_PAGE_SIZE}),
+    ("item typeahead", "items", {"find": "items", "filter": {"searchTerms": re.compile("^a")}, "sort": {"name": 1, "_id": 1}, "limit": DEFAULT_TYPEAHEAD_SIZE}),
+    ("get_sales", "sales", {"find": "sales", "filter": {}, "sort": {"saleDate": -1, "_id": -1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_sales date range", "sales", {"find": "sales", "filter": {"saleDate": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 2, 1)}}, "sort": {"saleDate": -1, "_id": -1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("dashboard recent sales", "sales", {"find": "sales", "filter": {}, "sort": {"saleDate": -1, "_id": -1}, "limit": 5}),
+    ("archived sales", "sales_archive", {"find": "sales_archive", "filter": {"day": {"$lte": datetime(2000, 1, 1)}}, "sort": {"day": -1}}),
+    ("archiver batch", "sales", {"find": "sales", "filter": {"saleDate": {"$lt": datetime(2000, 1, 1)}}, "sort": {"saleDate": 1, "_id": 1}, "limit": 1000}),
+    ("monthly sales", "sales_monthly", {"find": "sales_monthly", "filter": {"itemId": None, "month": {"$gte": "", "$lte": ""}}}),
+    ("get_cash_flows", "cashflows", {"find": "cashflows", "filter": {}, "sort": {"date": -1, "_id": -1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("cash flows since snapshot", "cashflows", {"find": "cashflows", "filter": {"date": {"$gte": datetime(2000, 1, 1)}}, "sort": {"date": 1}}),
+    ("get_cash_flows date range", "cashflows", {"find": "cashflows", "filter": {"date": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 2, 1)}}, "sort": {"date": -1, "_id": -1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("get_low_stock_items", "items", {"find": "items", "filter": {"isLow": True}, "sort": {"lowStockRatio": 1, "_id": 1}, "limit": DEFAULT_PAGE_SIZE}),
+    ("import low stock recount", "items", {"count": "items", "query": {"isLow": True}}),
+]
+
+async def ensure_indexes():
+    """Create the indexes in INDEX_SPEC. Existing identical indexes are left untouched"""
+    by_collection = {}
+    for collection, keys, options in INDEX_SPEC:
+        by_collection.setdefault(collection, []).append(IndexModel(keys, **options))
+    
+    async def create(collection, models):
+        try:
+            names = await db[collection].create_indexes(models)
+            logger.info(f"Indexes ready on {collection}: {names}")
+        except OperationFailure as e:
+            # Typically duplicate keys or an index with the same name and different options;
+            # the API still works without the index, so report it and keep starting up
+            logger.error(f"Failed to create indexes on {collection}: {e}")
+    
+    await asyncio.gather(*(create(collection, models) for collection, models in by_collection.items()))
+
+def find_plan_stages(plan, stages=None):
+    """Collect every stage name that appears in an explain output"""
+    if stages is None:
+        stages = set()
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            stages.add(plan["stage"])
+        for value in plan.values():
+            find_plan_stages(value, stages)
+    elif isinstance(plan, list):
+        for value in plan:
+            find_plan_stages(value, stages)
+    return stages
+
+async def audit_indexes():
+    """Explain each route query shape and report the ones that fall back to a collection scan"""
+    report = []
+    for label, collection, command in QUERY_SHAPES:
+        try:
+            explain = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        except OperationFailure as e:
+            logger.error(f"Index audit could not explain {label}: {e}")
+            continue
+        stages = find_plan_stages(explain.get("queryPlanner", explain))
+        collscan = "COLLSCAN" in stages
+        if collscan:
+            logger.warning(f"Index audit: {label} on {collection} runs a COLLSCAN")
+        else:
+            logger.info(f"Index audit: {label} on {collection} uses an index")
+        report.append({"query": label, "collection": collection, "collscan": collscan, "stages": sorted(stages)})
+    return report
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     global client
+    for task in (change_stream_task, health_task, archive_task, snapshot_task, forecast_task):
+        if task:
+            task.cancel()
     if client:
         client.close()
         logger.info("MongoDB connection closed")
@@ -213,8 +606,153 @@ def fix_id(item):
     if item and "_id" in item:
         item["id"] = str(item["_id"])
         del item["_id"]
+    # Timestamps are stored as BSON dates but the API speaks ISO strings
+    if item:
+        for key, value in item.items():
+            if isinstance(value, datetime):
+                item[key] = value.isoformat()
     return item
 
+def now_ms():
+    """Current time truncated to milliseconds, the precision of a BSON date"""
+    now = datetime.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+# Query parameter type for date bounds: a date means midnight at its start
+DateParam = Union[datetime, date]
+
+def to_local_naive(value):
+    """Timestamps are stored as naive local time; convert query values to match"""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def date_range_filter(field, start, end):
+    """Half-open [start, end) filter on a date field, either bound optional"""
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = to_local_naive(start)
+    if end is not None:
+        bounds["$lt"] = to_local_naive(end)
+    return {field: bounds} if bounds else {}
+
+# Keyset pagination
+def encode_cursor(doc, sort_field):
+    """Build an opaque cursor from the sort key and _id of the last document in a page"""
+    last_id = doc["_id"] if "_id" in doc else ObjectId(doc["id"])
+    value = last_id if sort_field == "_id" else doc.get(sort_field)
+    key = {"k": sort_field, "v": value, "id": last_id}
+    return base64.urlsafe_b64encode(json_util.dumps(key).encode()).decode()
+
+# Types a cursor's sort value may decode to; anything else, such as a document of query
+# operators, would be spliced into the page filter as is
+CURSOR_VALUE_TYPES = (datetime, str, int, float, ObjectId, type(None))
+
+def decode_cursor(cursor, sort_field):
+    """Decode a cursor produced by encode_cursor for the given sort field"""
+    try:
+        key = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, dict) or key.get("k") != sort_field or "id" not in key:
+        raise HTTPException(status_code=400, detail="Cursor does not match this listing")
+    if not isinstance(key["id"], ObjectId) or not isinstance(key.get("v"), CURSOR_VALUE_TYPES):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key["v"], key["id"]
+
+def keyset_filter(sort_field, direction, after):
+    """Filter selecting the documents that come after the cursor in (sort_field, _id) order"""
+    value, last_id = decode_cursor(after, sort_field)
+    op = "$lt" if direction < 0 else "$gt"
+    if sort_field == "_id":
+        return {"_id": {op: last_id}}
+    return {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, "_id": {op: last_id}}
+    ]}
+
+async def paginate(collection, query, sort_field, direction, limit, after=None, projection=None):
+    """Fetch one page in (sort_field, _id) order.
+
+    Pages are addressed by the last key seen rather than by offset, so every page
+    is a bounded index range read no matter how deep the client has paged.
+    With a projection the page is read through an aggregation ending in that $project.
+    Returns the page and the cursor for the next one (None on the last page).
+    """
+    if after:
+        page_filter = keyset_filter(sort_field, direction, after)
+        query = {"$and": [query, page_filter]} if query else page_filter
+    sort = [(sort_field, direction)]
+    if sort_field != "_id":
+        sort.append(("_id", direction))
+    # Fetch one extra document to learn whether another page exists
+    if projection is None:
+        docs = await collection.find(query).sort(sort).limit(limit + 1).to_list(limit + 1)
+    else:
+        pipeline = [{"$match": query}, {"$sort": dict(sort)}, {"$limit": limit + 1}, {"$project": projection}]
+        docs = await collection.aggregate(pipeline).to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], sort_field)
+    return docs, next_cursor
+
+def set_next_cursor(response, next_cursor):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+# Fast list responses
+def parse_fields(fields, model):
+    """Field names requested with ?fields=, checked against the response model; all by default"""
+    if fields is None:
+        return list(model.model_fields)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+def api_projection(names, sort_field):
+    """$project producing documents in API shape, plus the keys the page cursor is built from"""
+    projection = {"_id": 0, "id": {"$toString": "$_id"}}
+    for name in names:
+        if name != "id":
+            projection[name] = 1
+    if sort_field != "_id":
+        projection[sort_field] = 1
+    return projection
+
+def json_response(content):
+    """Encode content that is already in API shape, with orjson when it is installed"""
+    if orjson is not None:
+        return ORJSONResponse(content)
+    return JSONResponse(jsonable_encoder(content))
+
+async def fast_page(collection, query, sort_field, direction, limit, after, model, fields):
+    """One page of a list route through the fast path.
+
+    The documents come out of the database ready to send, so the response is returned
+    directly and FastAPI neither validates it against the route's model nor re-encodes it.
+    Dates stay datetimes until the encoder writes them as ISO strings.
+    """
+    names = parse_fields(fields, model)
+    docs, next_cursor = await paginate(
+        collection, query, sort_field, direction, limit, after, projection=api_projection(names, sort_field)
+    )
+    # The cursor keys were only needed for the cursor, drop them unless they were asked for
+    extra = {"id", sort_field} - set(names) - {"_id"}
+    if extra:
+        for doc in docs:
+            for key in extra:
+                doc.pop(key, None)
+    response = json_response(docs)
+    set_next_cursor(response, next_cursor)
+    return response
+
 # Models
 class ItemBase(BaseModel):
     name: str
@@ -228,6 +766,21 @@ class Item(ItemBase):
     createdAt: str
     updatedAt: str
 
+class ItemSuggestion(BaseModel):
+    id: str
+    name: str
+    quantity: int
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportSummary(BaseModel):
+    inserted: int
+    merged: int
+    rejected: int
+    errors: List[ImportRowError]
+
 class SaleBase(BaseModel):
     itemId: str
     quantity: int
@@ -240,6 +793,22 @@ class Sale(BaseModel):
     saleDate: str
     total: float
 
+class SaleBatch(BaseModel):
+    sales: List[SaleBase] = Field(..., min_length=1, max_length=MAX_SALE_BATCH)
+    # Ordered batches stop at the first failing line, the remaining lines are skipped
+    ordered: bool = False
+
+class SaleLineResult(BaseModel):
+    index: int
+    status: str  # "ok", "error" or "skipped"
+    sale: Optional[Sale] = None
+    error: Optional[str] = None
+
+class SaleBatchResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[SaleLineResult]
+
 class CashFlowBase(BaseModel):
     description: str
     amount: float
@@ -252,10 +821,88 @@ class CashFlow(BaseModel):
     isInflow: bool
     date: str
 
+class CashBalance(BaseModel):
+    asOf: str
+    balance: float
+    inflows: float
+    outflows: float
+    count: int
+
+class BalancePoint(BaseModel):
+    start: str
+    end: str
+    inflows: float
+    outflows: float
+    balance: float
+
 class MonthSale(BaseModel):
     month: str
     total: float
 
+class MonthlySalesPoint(BaseModel):
+    month: str  # YYYY-MM
+    total: float
+    quantity: int
+    count: int
+
+class TopItem(BaseModel):
+    itemId: str
+    itemName: str
+    revenue: float
+    units: int
+    sales: int
+
+class TypeRevenue(BaseModel):
+    type: str
+    revenue: float
+    units: int
+    sales: int
+    items: int
+    share: float  # of the revenue of the period
+
+class PeriodTotals(BaseModel):
+    start: str
+    end: str
+    revenue: float
+    units: int
+    sales: int
+
+class PeriodComparison(BaseModel):
+    current: PeriodTotals
+    previous: PeriodTotals
+    # Relative change from the previous period, None when it had nothing to compare with
+    change: Dict[str, Optional[float]]
+
+class ItemTurnover(BaseModel):
+    itemId: str
+    itemName: str
+    unitsSold: int
+    openingStock: int
+    closingStock: int
+    averageStock: float
+    turnover: float
+
+class ItemForecast(BaseModel):
+    itemId: str
+    name: str
+    quantity: int
+    lowStockThreshold: Optional[int] = None
+    dailyDemand: float
+    daysUntilStockout: Optional[float] = None  # None when the item does not sell
+    reorderPoint: int
+    suggestedReorder: int
+    needsReorder: bool
+
+class ForecastReport(BaseModel):
+    computedAt: str
+    method: str
+    historyDays: int
+    leadDays: int
+    coverDays: int
+    itemCount: int
+    reorderCount: int
+    items: List[ItemForecast]
+
 class DashboardStats(BaseModel):
     totalItems: int
     totalStock: int
@@ -264,191 +911,1633 @@ class DashboardStats(BaseModel):
     recentSales: List[Sale]
     monthlySales: List[MonthSale]
 
+def item_key(item):
+    """Items with the same name, brand and type are the same stock line"""
+    return {"name": item.name, "brand": item.brand, "type": item.type}
+
+def search_words(text):
+    """Lowercased words of text, split on anything that isn't a letter or a digit"""
+    return re.findall(r"[^\W_]+", text.lower())
+
+def search_terms(name, brand):
+    """Distinct words of an item's name and brand, stored as its indexed searchTerms"""
+    return sorted(set(search_words(name)) | set(search_words(brand)))
+
+def search_filter(q):
+    """Filter for items with a name or brand word starting with each word of q.
+
+    "den je" finds Jeans by Denim Co. The regexes are anchored and case-sensitive on
+    the lowercased words, so each is a range scan of the search_terms index. None when
+    q has no words at all.
+    """
+    words = search_words(q)[:MAX_SEARCH_WORDS]
+    if not words:
+        return None
+    conditions = [{"searchTerms": re.compile("^" + re.escape(word))} for word in words]
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+# get_items sort parameter: (field, direction)
+ITEM_SORTS = {
+    "id": ("_id", 1),
+    "name": ("name", 1),
+    "-name": ("name", -1),
+    "quantity": ("quantity", 1),
+    "-quantity": ("quantity", -1),
+}
+
+# Appended to every pipeline update that touches quantity or lowStockThreshold, so the
+# low-stock flag changes in the same atomic write and can be served from the low_stock index
+LOW_STOCK_FIELDS = {"$set": {
+    "isLow": {"$lt": ["$quantity", "$lowStockThreshold"]},
+    # Share of the threshold still in stock, only present on low items: 0 is sold out
+    "lowStockRatio": {"$cond": [
+        {"$lt": ["$quantity", "$lowStockThreshold"]},
+        {"$divide": ["$quantity", {"$max": ["$lowStockThreshold", 1]}]},
+        "$$REMOVE"
+    ]}
+}}
+
+def item_merge_update(item, now, new_id=None):
+    """Upsert pipeline that adds the quantity to an existing item or creates it.
+
+    new_id, when given, only becomes the _id of a newly created item, which lets the
+    caller tell an insert from a merge.
+    """
+    fields = {
+        "quantity": {"$add": [{"$ifNull": ["$quantity", 0]}, item.quantity]},
+        "lowStockThreshold": {"$ifNull": ["$lowStockThreshold", item.lowStockThreshold]},
+        "createdAt": {"$ifNull": ["$createdAt", now]},
+        "updatedAt": now,
+        # $literal, as a word could start with $ and read as a field path
+        "searchTerms": {"$literal": search_terms(item.name, item.brand)}
+    }
+    if new_id is not None:
+        fields["_id"] = {"$ifNull": ["$_id", new_id]}
+    return [{"$set": fields}, LOW_STOCK_FIELDS]
+
+def stock_update(delta, now):
+    """Pipeline update that moves quantity by delta and keeps the low-stock flag in step"""
+    return [{"$set": {"quantity": {"$add": ["$quantity", delta]}, "updatedAt": now}}, LOW_STOCK_FIELDS]
+
+# Dashboard KPI counters, kept current by the write routes
+STATS_ID = "dashboard"
+
+async def record_write(collections, counters=None):
+    """Bump the version of each written collection and apply KPI counter deltas.
+
+    Both go out as one upsert of the stats document. Versions only ever grow and drive
+    the ETags of the GET routes. When the upsert has to create the document, the
+    counters in it are partial; the missing reconciled flag makes the next dashboard
+    read rebuild them with reconcile_stats.
+
+    Called after the data writes have committed, never inside their transaction: every
+    write updates this one document, so any two concurrent transactions touching it
+    would conflict. A crash in between leaves the counters behind until the next
+    reconcile_stats.
+    """
+    inc = {key: value for key, value in (counters or {}).items() if value}
+    inc.update({f"versions.{name}": 1 for name in collections})
+    await db["stats"].update_one(
+        {"_id": STATS_ID},
+        {"$inc": inc, "$setOnInsert": {"epoch": ObjectId()}},
+        upsert=True
+    )
+
+async def load_versions():
+    """Collection versions and the epoch of the stats document, for ETags"""
+    return await db["stats"].find_one({"_id": STATS_ID}, {"versions": 1, "epoch": 1}) or {}
+
+async def compute_stats():
+    """Recompute the KPI counters: items with a full scan, the cash balance from the ledger"""
+    items_pipeline = [
+        {"$group": {
+            "_id": None,
+            "totalItems": {"$sum": 1},
+            "totalStock": {"$sum": "$quantity"},
+            "lowStockCount": {"$sum": {
+                "$cond": [{"$lt": ["$quantity", "$lowStockThreshold"]}, 1, 0]
+            }}
+        }}
+    ]
+    items_result, cash = await asyncio.gather(
+        db.items.aggregate(items_pipeline).to_list(1),
+        cash_totals([datetime.max], db)
+    )
+    item_totals = items_result[0] if items_result else {}
+    return {
+        "totalItems": item_totals.get("totalItems", 0),
+        "totalStock": item_totals.get("totalStock", 0),
+        "lowStockCount": item_totals.get("lowStockCount", 0),
+        "cashBalance": cash[0]["balance"]
+    }
+
+async def reconcile_stats():
+    """Rebuild the stats document from scratch and report how far the counters had drifted"""
+    current = await db["stats"].find_one({"_id": STATS_ID}) or {}
+    existed = current.get("reconciled", False)
+    fresh = await compute_stats()
+    # Corrected counters change the dashboard, so its cached copies and ETags must go
+    await db["stats"].update_one(
+        {"_id": STATS_ID},
+        {
+            "$set": {**fresh, "reconciled": True},
+            "$inc": {f"versions.{name}": 1 for name in ("items", "sales", "cashflows")},
+            "$setOnInsert": {"epoch": ObjectId()}
+        },
+        upsert=True
+    )
+    drift = {key: value - current.get(key, 0) for key, value in fresh.items() if value != current.get(key, 0)}
+    response_cache.invalidate("items", "sales", "cashflows")
+    if existed and drift:
+        logger.warning(f"Stats counters had drifted: {drift}")
+    return {"counters": fresh, "drift": drift if existed else {}, "existed": existed}
+
+async def backfill_low_stock_flags(batch_size=1000):
+    """Set isLow and lowStockRatio on every item from its quantity and threshold.
+
+    Runs in _id-ordered batches so it can go while the API is serving; rerunning it is
+    harmless. Marks the stats document once done so startup doesn't repeat it.
+    """
+    updated = 0
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = await db.items.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size).to_list(None)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        result = await db.items.update_many({"_id": {"$in": [doc["_id"] for doc in docs]}}, [LOW_STOCK_FIELDS])
+        updated += result.modified_count
+    await db["stats"].update_one(
+        {"_id": STATS_ID},
+        {"$set": {"lowStockFlags": True}, "$inc": {"versions.items": 1}, "$setOnInsert": {"epoch": ObjectId()}},
+        upsert=True
+    )
+    response_cache.invalidate("items")
+    return updated
+
+async def backfill_search_terms(batch_size=1000):
+    """Set searchTerms on every item from its name and brand.
+
+    Same batching as backfill_low_stock_flags; rerunning it is harmless, and it marks
+    the stats document once done so startup doesn't repeat it.
+    """
+    updated = 0
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = await db.items.find(query, {"name": 1, "brand": 1}).sort("_id", 1).limit(batch_size).to_list(None)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        ops = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"searchTerms": search_terms(doc["name"], doc["brand"])}})
+            for doc in docs
+        ]
+        result = await db.items.bulk_write(ops, ordered=False)
+        updated += result.modified_count
+    await db["stats"].update_one(
+        {"_id": STATS_ID},
+        {"$set": {"searchTerms": True}, "$inc": {"versions.items": 1}, "$setOnInsert": {"epoch": ObjectId()}},
+        upsert=True
+    )
+    response_cache.invalidate("items")
+    return updated
+
+# Server-sent events
+def low_stock_event(item):
+    return {
+        "id": str(item["_id"]),
+        "name": item["name"],
+        "quantity": item["quantity"],
+        "lowStockThreshold": item["lowStockThreshold"],
+        "isLow": item["quantity"] < item["lowStockThreshold"]
+    }
+
+def publish_event(event_type, data):
+    """Publish from a write route, unless the change stream watcher is the event source"""
+    if EVENTS_SOURCE == "local":
+        event_bus.publish(event_type, data)
+
+async def watch_change_streams():
+    """Publish events for writes seen on the database change stream, from any process.
+
+    isLow only shows up among the updated fields when its value changed, which is
+    exactly a low-stock crossing.
+    """
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": ["items", "sales", "cashflows"]},
+        "operationType": {"$in": ["insert", "update", "replace"]}
+    }}]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                logger.info("Watching change streams for events")
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    collection = change["ns"]["coll"]
+                    doc = change.get("fullDocument")
+                    if doc is None:
+                        continue
+                    if collection == "sales" and change["operationType"] == "insert":
+                        event_bus.publish("sale", fix_id(doc))
+                    elif collection == "cashflows" and change["operationType"] == "insert":
+                        event_bus.publish("cashflow", fix_id(doc))
+                    elif collection == "items":
+                        if change["operationType"] == "update":
+                            crossed = "isLow" in change["updateDescription"]["updatedFields"]
+                        else:
+                            crossed = doc.get("isLow", False)
+                        if crossed:
+                            event_bus.publish("lowstock", low_stock_event(doc))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Change stream failed, retrying: {e}")
+            await asyncio.sleep(5)
+
+# Monthly sales rollup: one document per (month, itemId), itemId None holding the month total
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+MAX_ROLLUP_MONTHS = 120
+
+def month_key(timestamp):
+    """YYYY-MM bucket of a datetime, or of an ISO string left over from before the date migration"""
+    if isinstance(timestamp, datetime):
+        return timestamp.strftime("%Y-%m")
+    return timestamp[:7]
+
+def shift_month(month, offset):
+    year, month_num = map(int, month.split("-"))
+    year, month_index = divmod(year * 12 + month_num - 1 + offset, 12)
+    return f"{year:04d}-{month_index + 1:02d}"
+
+def month_span(start, end):
+    """All YYYY-MM keys from start to end inclusive"""
+    months = [start]
+    while months[-1] < end:
+        months.append(shift_month(months[-1], 1))
+    return months
+
+async def update_sales_rollup(sales, item_types):
+    """Add freshly inserted sales to the monthly rollup with one bulk_write of upserts.
+
+    Like record_write, called after the sales are committed rather than in their
+    transaction, as every sale updates the same all-items document of the month. A
+    crash in between leaves the rollup short until rebuild_sales_rollup.
+    """
+    buckets = {}
+    for sale in sales:
+        month = month_key(sale["saleDate"])
+        for item_id in (None, sale["itemId"]):
+            bucket = buckets.setdefault((month, item_id), {"total": 0, "quantity": 0, "count": 0, "itemName": sale["itemName"]})
+            bucket["total"] += sale["total"]
+            bucket["quantity"] += sale["quantity"]
+            bucket["count"] += 1
+    ops = []
+    for (month, item_id), bucket in buckets.items():
+        update = {"$inc": {"total": bucket["total"], "quantity": bucket["quantity"], "count": bucket["count"]}}
+        if item_id is not None:
+            update["$set"] = {"itemName": bucket["itemName"], "type": item_types.get(item_id)}
+        ops.append(UpdateOne({"itemId": item_id, "month": month}, update, upsert=True))
+    if ops:
+        await db.sales_monthly.bulk_write(ops, ordered=False)
+
+async def rebuild_sales_rollup():
+    """Rebuild sales_monthly from the full sales history, archived sales included, with
+    server-side aggregations.
+
+    Sales recorded while this runs may be missed or counted twice, so run it when
+    the tills are quiet.
+    """
+    await db.sales_monthly.delete_many({})
+    month = {"$cond": [
+        {"$eq": [{"$type": "$saleDate"}, "date"]},
+        {"$dateToString": {"format": "%Y-%m", "date": "$saleDate"}},
+        {"$substr": ["$saleDate", 0, 7]}  # Not yet migrated to a BSON date
+    ]}
+    sums = {"total": {"$sum": "$total"}, "quantity": {"$sum": "$quantity"}, "count": {"$sum": 1}}
+    merge = {"$merge": {"into": "sales_monthly", "on": ["itemId", "month"], "whenMatched": "replace"}}
+    sales = await sales_in_range(None)
+    per_item = [
+        *sales,
+        {"$group": {"_id": {"month": month, "itemId": "$itemId"}, "itemName": {"$last": "$itemName"}, **sums}},
+        {"$lookup": {
+            "from": "items",
+            "let": {"id": {"$convert": {"input": "$_id.itemId", "to": "objectId", "onError": None}}},
+            "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$id"]}}}, {"$project": {"type": 1}}],
+            "as": "item"
+        }},
+        {"$project": {
+            "_id": 0, "month": "$_id.month", "itemId": "$_id.itemId", "itemName": 1,
+            "type": {"$arrayElemAt": ["$item.type", 0]}, "total": 1, "quantity": 1, "count": 1
+        }},
+        merge
+    ]
+    month_totals = [
+        *sales,
+        {"$group": {"_id": month, **sums}},
+        {"$project": {"_id": 0, "month": "$_id", "itemId": {"$literal": None}, "total": 1, "quantity": 1, "count": 1}},
+        merge
+    ]
+    await db.sales.aggregate(per_item).to_list(None)
+    await db.sales.aggregate(month_totals).to_list(None)
+    await record_write(["sales"])
+    response_cache.invalidate("sales")
+    months = await db.sales_monthly.count_documents({"itemId": None})
+    logger.info(f"Rebuilt monthly sales rollup: {months} months")
+    return months
+
+async def query_sales_rollup(start, end, item_id=None, item_type=None):
+    """Monthly totals from start to end (YYYY-MM, inclusive), zero-filled for months without sales"""
+    month_range = {"$gte": start, "$lte": end}
+    if item_type is not None:
+        query = {"type": item_type, "month": month_range}
+        if item_id is not None:
+            query["itemId"] = item_id
+        docs = await analytics_db.sales_monthly.aggregate([
+            {"$match": query},
+            {"$group": {
+                "_id": "$month",
+                "total": {"$sum": "$total"},
+                "quantity": {"$sum": "$quantity"},
+                "count": {"$sum": "$count"}
+            }},
+            {"$set": {"month": "$_id"}}
+        ]).to_list(None)
+    else:
+        docs = await analytics_db.sales_monthly.find({"itemId": item_id, "month": month_range}).to_list(None)
+    by_month = {doc["month"]: doc for doc in docs}
+    return [
+        {
+            "month": month,
+            "total": by_month.get(month, {}).get("total", 0),
+            "quantity": by_month.get(month, {}).get("quantity", 0),
+            "count": by_month.get(month, {}).get("count", 0)
+        }
+        for month in month_span(start, end)
+    ]
+
+# Sales archive: sales older than SALES_ARCHIVE_DAYS packed into one sales_archive document
+# per item and day, {itemId, day, itemName, lines: [sale without itemId/itemName], count,
+# quantity, total}. Hot sales and their indexes then only cover the horizon, while the
+# archive holds one document and index entry per item and day, in a compressed collection
+def sale_day(timestamp):
+    """Midnight starting the day of timestamp, the day key of archive buckets"""
+    return datetime.combine(timestamp.date(), datetime.min.time())
+
+def sale_order(sale):
+    return sale["saleDate"], sale["_id"]
+
+async def create_sales_archive():
+    """Create sales_archive with SALES_ARCHIVE_COMPRESSOR block compression"""
+    options = {}
+    if SALES_ARCHIVE_COMPRESSOR:
+        options["storageEngine"] = {"wiredTiger": {"configString": f"block_compressor={SALES_ARCHIVE_COMPRESSOR}"}}
+    try:
+        await db.create_collection("sales_archive", **options)
+        logger.info(f"Created sales_archive (compressor: {SALES_ARCHIVE_COMPRESSOR or 'default'})")
+    except OperationFailure as e:
+        # Already created by another process, or an unsupported compressor; the archiver
+        # creates the collection with default options on its first write either way
+        logger.warning(f"Could not create sales_archive: {e}")
+
+async def archive_cutoff():
+    """Sales before this date may be in sales_archive rather than sales; None if none ever were"""
+    doc = await db["stats"].find_one({"_id": STATS_ID}, {"salesArchivedBefore": 1})
+    return (doc or {}).get("salesArchivedBefore")
+
+def reaches_archive(cutoff, start):
+    """Whether a range starting at start can include archived sales"""
+    return cutoff is not None and (start is None or to_local_naive(start) < cutoff)
+
+async def archive_sales(days=SALES_ARCHIVE_DAYS, batch_size=1000):
+    """Move the sales of whole days more than days ago from sales into sales_archive.
+
+    Batches go oldest first: one unordered bulk_write with an upsert per sale, then one
+    delete. An upsert only pushes its line to a bucket not holding it yet, so a sale moved
+    again after a crash between the two writes, or by a second process, fails on the
+    unique index instead of being counted twice. Only the sales found in sales_archive
+    afterwards are deleted; any other is left in sales for the next run. The cutoff is
+    published before any sale leaves sales, so readers always know to look in the
+    archive. Returns the sales moved.
+    """
+    cutoff = sale_day(datetime.now() - timedelta(days=days))
+    query = {"saleDate": {"$lt": cutoff}}
+    if not await db.sales.find_one(query, {"_id": 1}):
+        return 0
+    await db["stats"].update_one(
+        {"_id": STATS_ID},
+        {"$max": {"salesArchivedBefore": cutoff}, "$setOnInsert": {"epoch": ObjectId()}},
+        upsert=True
+    )
+    moved = 0
+    while True:
+        sales = await db.sales.find(query).sort([("saleDate", 1), ("_id", 1)]).limit(batch_size).to_list(None)
+        if not sales:
+            break
+        ops = [
+            UpdateOne(
+                {"itemId": sale["itemId"], "day": sale_day(sale["saleDate"]), "lines._id": {"$ne": sale["_id"]}},
+                {
+                    "$push": {"lines": {key: sale[key] for key in ("_id", "quantity", "total", "saleDate")}},
+                    "$inc": {"count": 1, "quantity": sale["quantity"], "total": sale["total"]},
+                    "$setOnInsert": {"itemName": sale["itemName"]}
+                },
+                upsert=True
+            )
+            for sale in sales
+        ]
+        try:
+            await db.sales_archive.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys are buckets that already hold the line, or that another
+            # process created meanwhile; the check below tells them apart
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+        sale_ids = {sale["_id"] for sale in sales}
+        buckets = await db.sales_archive.find(
+            {
+                "itemId": {"$in": list({sale["itemId"] for sale in sales})},
+                "day": {"$in": list({sale_day(sale["saleDate"]) for sale in sales})},
+                "lines._id": {"$in": list(sale_ids)}
+            },
+            {"lines._id": 1}
+        ).to_list(None)
+        archived = sale_ids & {line["_id"] for bucket in buckets for line in bucket["lines"]}
+        await db.sales.delete_many({"_id": {"$in": list(archived)}})
+        moved += len(archived)
+        if len(archived) < len(sales):
+            logger.warning(f"{len(sales) - len(archived)} sales not found in sales_archive, left for the next run")
+            break
+    logger.info(f"Archived {moved} sales from before {cutoff.date()}")
+    return moved
+
+async def run_sales_archiver():
+    """Archive sales past the horizon now and every SALES_ARCHIVE_INTERVAL seconds"""
+    while True:
+        try:
+            await archive_sales(SALES_ARCHIVE_DAYS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Sales archiver failed: {e}")
+        await asyncio.sleep(SALES_ARCHIVE_INTERVAL)
+
+def archived_sales_pipeline(start, end):
+    """Aggregation stages on sales_archive yielding its sales in [start, end) shaped like sales"""
+    return [
+        {"$match": archive_days(start, end, inclusive=False)},
+        {"$unwind": "$lines"},
+        {"$replaceWith": {"$mergeObjects": ["$lines", {"itemId": "$itemId", "itemName": "$itemName"}]}},
+        {"$match": date_range_filter("saleDate", start, end)}
+    ]
+
+def bucket_sales(bucket, start, end):
+    """The sales of an archive bucket in [start, end), shaped like those in sales"""
+    return [
+        {**line, "itemId": bucket["itemId"], "itemName": bucket["itemName"]}
+        for line in bucket["lines"]
+        if (start is None or line["saleDate"] >= start) and (end is None or line["saleDate"] < end)
+    ]
+
+def archive_days(start, upper, inclusive):
+    """Filter on the day of archive buckets that can hold sales from start up to upper"""
+    days = {}
+    if start is not None:
+        days["$gte"] = sale_day(start)
+    if upper is not None:
+        days["$lte" if inclusive else "$lt"] = sale_day(upper) if inclusive else upper
+    return {"day": days} if days else {}
+
+async def archived_sales(start, end, limit, after):
+    """Up to limit archived sales in [start, end), newest first and after the cursor if given.
+
+    Buckets are read a day at a time, newest first, until limit sales are in hand: every
+    sale of an older day sorts after all of them.
+    """
+    start = to_local_naive(start) if start is not None else None
+    end = to_local_naive(end) if end is not None else None
+    before = None
+    upper = end
+    if after:
+        value, last_id = decode_cursor(after, "saleDate")
+        if not isinstance(value, datetime):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # Cursors hold dates as UTC; sale dates are stored naive, with the same wall clock
+        before = (value.replace(tzinfo=None), last_id)
+        upper = before[0] if upper is None else min(upper, before[0])
+    cursor = db.sales_archive.find(archive_days(start, upper, inclusive=True)).sort("day", -1)
+    sales = []
+    try:
+        async for bucket in cursor:
+            if len(sales) >= limit and bucket["day"] < sale_day(sales[-1]["saleDate"]):
+                break
+            sales.extend(
+                sale for sale in bucket_sales(bucket, start, end)
+                if before is None or sale_order(sale) < before
+            )
+            sales.sort(key=sale_order, reverse=True)
+    finally:
+        await cursor.close()
+    return sales[:limit]
+
+async def archived_then_hot(start, end, hot):
+    """Archived sales in [start, end), oldest first, followed by the documents of the hot cursor.
+
+    Buckets are sorted by day, so only one day of archived sales is held at a time.
+    """
+    start = to_local_naive(start) if start is not None else None
+    end = to_local_naive(end) if end is not None else None
+    archive = analytics_db.sales_archive.find(archive_days(start, end, inclusive=False)).sort("day", 1)
+    try:
+        day, pending = None, []
+        async for bucket in archive:
+            if bucket["day"] != day:
+                for sale in sorted(pending, key=sale_order):
+                    yield sale
+                day, pending = bucket["day"], []
+            pending.extend(bucket_sales(bucket, start, end))
+        for sale in sorted(pending, key=sale_order):
+            yield sale
+        async for doc in hot:
+            yield doc
+    finally:
+        await archive.close()
+        await hot.close()
+
+async def paginate_with_archive(query, start, end, limit, after, cutoff):
+    """paginate for get_sales over sales and sales_archive together"""
+    sales, next_cursor = await paginate(db.sales, query, "saleDate", -1, limit, after)
+    # A full page that ends at or after the cutoff sorts before everything archived
+    if next_cursor and sales[-1]["saleDate"] >= cutoff:
+        return sales, next_cursor
+    archived = await archived_sales(start, end, limit + 1, after)
+    merged = sorted(sales + archived, key=sale_order, reverse=True)
+    page = merged[:limit]
+    more = next_cursor is not None or len(merged) > limit
+    return page, encode_cursor(page[-1], "saleDate") if more and page else None
+
+# Cash ledger: cash_snapshots holds, for each period boundary (_id), the cumulative
+# inflows, outflows and count of the cash flows dated before it. Any balance is the
+# nearest snapshot at or before its time plus the cash flows between the two
+CASH_TOTALS = ("inflows", "outflows", "count")
+MAX_BALANCE_POINTS = 1000
+# Boundaries younger than this are left for the next run, so that a cash flow dated just
+# before one but still being written makes it into the snapshot
+CASH_SNAPSHOT_DELAY = timedelta(minutes=1)
+
+def period_start(timestamp, period):
+    if period == "month":
+        return datetime(timestamp.year, timestamp.month, 1)
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+def next_period(boundary, period):
+    if period == "month":
+        return datetime(boundary.year + boundary.month // 12, boundary.month % 12 + 1, 1)
+    return boundary + timedelta(days=1)
+
+def add_cash_flow_totals(totals, flow):
+    totals["inflows" if flow["isInflow"] else "outflows"] += flow["amount"]
+    totals["count"] += 1
+
+def cash_flows_between(source, start, end):
+    """Cursor over the cash flows in [start, end), oldest first, with only what totals need"""
+    return source.cashflows.find(
+        date_range_filter("date", start, end), {"_id": 0, "date": 1, "amount": 1, "isInflow": 1}
+    ).sort("date", 1)
+
+async def cash_totals(boundaries, source):
+    """Totals and balance of the cash flows dated before each of the sorted boundaries.
+
+    Boundaries with a snapshot are read from it. Every other boundary adds the cash flows
+    since its nearest earlier snapshot, read once per snapshot for all the boundaries
+    that share it, so the cost follows the cash flows not covered by snapshots.
+    """
+    first, last = boundaries[0], boundaries[-1]
+    base, later = await asyncio.gather(
+        source.cash_snapshots.find_one({"_id": {"$lte": first}}, sort=[("_id", -1)]),
+        source.cash_snapshots.find({"_id": {"$gt": first, "$lte": last}}).sort("_id", 1).to_list(None)
+    )
+    snapshots = ([base] if base else []) + later
+    snapshot_times = [snapshot["_id"] for snapshot in snapshots]
+    # Index of each boundary's snapshot (-1 for none) and how far past it flows are needed
+    nearest = [bisect.bisect_right(snapshot_times, boundary) - 1 for boundary in boundaries]
+    stretches = {}
+    for boundary, index in zip(boundaries, nearest):
+        if index < 0 or snapshot_times[index] != boundary:
+            stretches[index] = boundary
+
+    async def prefix_sums(index, end):
+        """Flow dates since snapshot index, with the running totals after each flow"""
+        start = snapshot_times[index] if index >= 0 else None
+        dates, running = [], []
+        totals = dict.fromkeys(CASH_TOTALS, 0)
+        async for flow in cash_flows_between(source, start, end):
+            add_cash_flow_totals(totals, flow)
+            dates.append(flow["date"])
+            running.append(dict(totals))
+        return index, (dates, running)
+
+    sums = dict(await asyncio.gather(*(prefix_sums(index, end) for index, end in stretches.items())))
+    results = []
+    for boundary, index in zip(boundaries, nearest):
+        totals = {key: snapshots[index][key] for key in CASH_TOTALS} if index >= 0 else dict.fromkeys(CASH_TOTALS, 0)
+        if index in sums:
+            dates, running = sums[index]
+            position = bisect.bisect_left(dates, boundary)
+            if position:
+                for key in CASH_TOTALS:
+                    totals[key] += running[position - 1][key]
+        totals["balance"] = totals["inflows"] - totals["outflows"]
+        results.append(totals)
+    return results
+
+async def snapshot_cash_balances(period=CASH_SNAPSHOT_PERIOD):
+    """Write the snapshots of every period boundary since the latest one, up to now.
+
+    One pass over the cash flows since the latest snapshot. Cash flows are only ever
+    added with the current time, so a snapshot stays right once written; after editing
+    cash flows by other means run rebuild_cash_snapshots. Returns the snapshots written.
+    """
+    latest = await db.cash_snapshots.find_one({}, sort=[("_id", -1)])
+    if latest:
+        since = latest["_id"]
+        totals = {key: latest[key] for key in CASH_TOTALS}
+        boundary = next_period(since, period)
+    else:
+        oldest = await db.cashflows.find_one({}, {"date": 1}, sort=[("date", 1)])
+        if not oldest:
+            return 0
+        since = None
+        totals = dict.fromkeys(CASH_TOTALS, 0)
+        boundary = next_period(period_start(oldest["date"], period), period)
+    horizon = datetime.now() - CASH_SNAPSHOT_DELAY
+    if boundary > horizon:
+        return 0
+
+    written = 0
+    ops = []
+    async def flush():
+        nonlocal ops, written
+        if ops:
+            await db.cash_snapshots.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+
+    def snapshot(boundary):
+        ops.append(UpdateOne(
+            {"_id": boundary},
+            {"$set": {**totals, "balance": totals["inflows"] - totals["outflows"]}},
+            upsert=True
+        ))
+
+    last = period_start(horizon, period)
+    async for flow in cash_flows_between(db, since, last):
+        while flow["date"] >= boundary:
+            snapshot(boundary)
+            boundary = next_period(boundary, period)
+        add_cash_flow_totals(totals, flow)
+        if len(ops) >= 1000:
+            await flush()
+    while boundary <= last:
+        snapshot(boundary)
+        boundary = next_period(boundary, period)
+    await flush()
+    if written:
+        logger.info(f"Wrote {written} cash balance snapshots up to {last}")
+    return written
+
+async def rebuild_cash_snapshots(period=CASH_SNAPSHOT_PERIOD):
+    """Rewrite every snapshot from the full cash flow history"""
+    await db.cash_snapshots.delete_many({})
+    return await snapshot_cash_balances(period)
+
+async def run_cash_snapshots():
+    """Catch the snapshots up now and every CASH_SNAPSHOT_INTERVAL seconds"""
+    while True:
+        try:
+            await snapshot_cash_balances()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Cash balance snapshots failed: {e}")
+        await asyncio.sleep(CASH_SNAPSHOT_INTERVAL)
+
+async def refresh_forecast():
+    """Recompute the demand forecast of every item, archived sales included"""
+    return await forecaster.refresh(analytics_db, await archive_cutoff())
+
+async def run_forecasts():
+    """Recompute the forecast now and every FORECAST_INTERVAL seconds"""
+    while True:
+        try:
+            await refresh_forecast()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Forecast failed: {e}")
+        await asyncio.sleep(FORECAST_INTERVAL)
+
+# Reports, aggregated next to the data over a [from, to) range of sale dates
+REPORT_DEFAULT_DAYS = 30
+
+def report_range(start, end):
+    """Resolve a report's from/to, by default the 30 days up to the end of today.
+
+    The default is aligned to midnight so that it stays the same memo key all day.
+    """
+    if end is None:
+        end = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    else:
+        end = to_local_naive(end)
+    start = end - timedelta(days=REPORT_DEFAULT_DAYS) if start is None else to_local_naive(start)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="from must be before to")
+    return start, end
+
+async def memoized_report(name, params, collections, compute):
+    """Return the result of compute(), computed once per report, parameters and data version.
+
+    The key holds the versions of the collections the report reads, so a sale recorded
+    by any API process makes the next request for the report recompute it. Reports are
+    not memoized with a non-primary ANALYTICS_READ_PREFERENCE: the versions come from the
+    primary, and a result read from a lagging secondary would be kept under them.
+    """
+    if ANALYTICS_READ_PREFERENCE != "primary":
+        return await compute()
+    state = await load_versions()
+    versions = state.get("versions", {})
+    key = (
+        name,
+        tuple(sorted((k, str(v)) for k, v in params.items())),
+        str(state.get("epoch")),
+        tuple(versions.get(collection, 0) for collection in collections)
+    )
+    result = report_cache.get(key)
+    if result is None:
+        result = await compute()
+        report_cache.set(key, result)
+    return result
+
+async def sales_in_range(start, end=None):
+    """Leading stages of a sales aggregation over [start, end), either bound optional.
+
+    Ranges that reach back before the archive cutoff also read the archived sales, as
+    documents shaped like those in sales.
+    """
+    stages = [{"$match": date_range_filter("saleDate", start, end)}]
+    cutoff = await archive_cutoff()
+    if cutoff is not None and (start is None or start < cutoff):
+        stages.append({"$unionWith": {"coll": "sales_archive", "pipeline": archived_sales_pipeline(start, end)}})
+    return stages
+
+def item_lookup(fields):
+    """$lookup of the item a sales group (_id = itemId string) belongs to, as an "item" array"""
+    return {"$lookup": {
+        "from": "items",
+        "let": {"id": {"$convert": {"input": "$_id", "to": "objectId", "onError": None}}},
+        "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$id"]}}}, {"$project": {field: 1 for field in fields}}],
+        "as": "item"
+    }}
+
+SALES_SUMS = {"revenue": {"$sum": "$total"}, "units": {"$sum": "$quantity"}, "sales": {"$sum": 1}}
+
+async def top_items_report(start, end, by, limit):
+    pipeline = [
+        *await sales_in_range(start, end),
+        {"$group": {"_id": "$itemId", "itemName": {"$last": "$itemName"}, **SALES_SUMS}},
+        {"$sort": {by: -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "itemId": "$_id", "itemName": 1, "revenue": 1, "units": 1, "sales": 1}}
+    ]
+    return await analytics_db.sales.aggregate(pipeline).to_list(None)
+
+async def revenue_by_type_report(start, end):
+    # Group by item first so the lookup runs once per item sold, not once per sale
+    pipeline = [
+        *await sales_in_range(start, end),
+        {"$group": {"_id": "$itemId", **SALES_SUMS}},
+        item_lookup(["type"]),
+        {"$group": {
+            "_id": {"$ifNull": [{"$arrayElemAt": ["$item.type", 0]}, "Unknown"]},
+            "revenue": {"$sum": "$revenue"},
+            "units": {"$sum": "$units"},
+            "sales": {"$sum": "$sales"},
+            "items": {"$sum": 1}
+        }},
+        {"$sort": {"revenue": -1, "_id": 1}},
+        {"$project": {"_id": 0, "type": "$_id", "revenue": 1, "units": 1, "sales": 1, "items": 1}}
+    ]
+    rows = await analytics_db.sales.aggregate(pipeline).to_list(None)
+    total = sum(row["revenue"] for row in rows)
+    for row in rows:
+        row["share"] = row["revenue"] / total if total else 0.0
+    return rows
+
+async def comparison_report(start, end):
+    """Totals of the range and of the range of the same length right before it, in one pass"""
+    previous_start = start - (end - start)
+    pipeline = [
+        *await sales_in_range(previous_start, end),
+        {"$group": {"_id": {"$cond": [{"$gte": ["$saleDate", start]}, "current", "previous"]}, **SALES_SUMS}}
+    ]
+    totals = {doc["_id"]: doc for doc in await analytics_db.sales.aggregate(pipeline).to_list(None)}
+    periods = {
+        "current": (start, end),
+        "previous": (previous_start, start),
+    }
+    result = {}
+    for period, (period_start, period_end) in periods.items():
+        doc = totals.get(period, {})
+        result[period] = {
+            "start": period_start.isoformat(),
+            "end": period_end.isoformat(),
+            "revenue": doc.get("revenue", 0),
+            "units": doc.get("units", 0),
+            "sales": doc.get("sales", 0)
+        }
+    result["change"] = {
+        metric: (result["current"][metric] - result["previous"][metric]) / result["previous"][metric]
+        if result["previous"][metric] else None
+        for metric in ("revenue", "units", "sales")
+    }
+    return result
+
+async def turnover_report(start, end, limit):
+    """Units sold over average stock for the items that sold in the range.
+
+    Receipts aren't recorded, so stock levels are reconstructed from sales alone: stock
+    at the end of the range is today's quantity plus what sold since, and stock at the
+    start is that plus what sold during the range.
+    """
+    in_range = {"$lt": ["$saleDate", end]}
+    pipeline = [
+        *await sales_in_range(start),
+        {"$group": {
+            "_id": "$itemId",
+            "itemName": {"$last": "$itemName"},
+            "unitsSold": {"$sum": {"$cond": [in_range, "$quantity", 0]}},
+            "soldSince": {"$sum": {"$cond": [in_range, 0, "$quantity"]}}
+        }},
+        {"$match": {"unitsSold": {"$gt": 0}}},
+        item_lookup(["quantity"]),
+        {"$unwind": "$item"},
+        {"$set": {"closingStock": {"$add": ["$item.quantity", "$soldSince"]}}},
+        {"$set": {"openingStock": {"$add": ["$closingStock", "$unitsSold"]}}},
+        {"$set": {"averageStock": {"$divide": [{"$add": ["$openingStock", "$closingStock"]}, 2]}}},
+        # averageStock is at least unitsSold / 2, so never zero here
+        {"$set": {"turnover": {"$divide": ["$unitsSold", "$averageStock"]}}},
+        {"$sort": {"turnover": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0, "itemId": "$_id", "itemName": 1, "unitsSold": 1,
+            "openingStock": 1, "closingStock": 1, "averageStock": 1, "turnover": 1
+        }}
+    ]
+    return await analytics_db.sales.aggregate(pipeline).to_list(None)
+
+# Columns of the export routes, in output order
+SALE_EXPORT_FIELDS = ["id", "itemId", "itemName", "quantity", "total", "saleDate"]
+CASHFLOW_EXPORT_FIELDS = ["id", "description", "amount", "isInflow", "date"]
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+async def stream_export(cursor, fields, format):
+    """Encode documents as CSV or NDJSON as they come off the cursor.
+
+    Rows skip the pydantic models and are flushed once per cursor batch, so memory
+    use is bounded by the batch size rather than by the size of the export.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if format == "csv" else None
+    if writer:
+        writer.writerow(fields)
+    rows = 0
+    try:
+        async for doc in cursor:
+            doc["id"] = doc.pop("_id")
+            values = [export_value(doc.get(field)) for field in fields]
+            if writer:
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(fields, values))))
+                buffer.write("\n")
+            rows += 1
+            if rows % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        # Release the server-side cursor if the client disconnects mid-export
+        await (cursor.aclose() if hasattr(cursor, "aclose") else cursor.close())
+    logger.info(f"Exported {rows} rows")
+
+def export_cursor(collection, query, sort_field, fields):
+    return collection.find(
+        query, {field: 1 for field in fields if field != "id"}
+    ).sort([(sort_field, 1), ("_id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+
+def export_response(cursor, fields, format, name):
+    """Stream the documents of cursor, or of any async iterator with an aclose"""
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_export(cursor, fields, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    )
+
+async def iter_body_lines(request):
+    """Yield the request body line by line as it arrives, without buffering it whole"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+def format_validation_error(e):
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
 # Routes
 
 # Items routes
 @app.get("/api/items", response_model=List[Item])
-async def get_items():
-    logger.info("Getting all items")
-    items = await db.items.find().to_list(1000)
+async def get_items(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    q: Optional[str] = Query(None, max_length=MAX_SEARCH_LENGTH),
+    match: Literal["prefix", "text"] = "prefix",
+    item_type: Optional[str] = Query(None, alias="type"),
+    brand: Optional[str] = None,
+    lowOnly: bool = False,
+    sort: Literal["id", "name", "-name", "quantity", "-quantity"] = "id",
+    fields: Optional[str] = None
+):
+    """Items in the requested order, optionally narrowed by a search and filters.
+
+    q keeps the items with a name or brand word starting with each word of q. With
+    match=text it is a full-text search instead, ranked by relevance and returned as a
+    single page regardless of sort. type and brand are exact matches, lowOnly keeps
+    only the low stock items.
+    """
+    logger.info("Getting items")
+    query = {}
+    if item_type is not None:
+        query["type"] = item_type
+    if brand is not None:
+        query["brand"] = brand
+    if lowOnly:
+        query["isLow"] = True
+    if q and match == "text":
+        return await text_search_items(query, q, limit, fields)
+    if q:
+        search = search_filter(q)
+        if search is None:
+            return json_response([])
+        query.update(search)
+    sort_field, direction = ITEM_SORTS[sort]
+    if FAST_JSON or fields:
+        return await fast_page(db.items, query, sort_field, direction, limit, after, Item, fields)
+    items, next_cursor = await paginate(db.items, query, sort_field, direction, limit, after)
+    set_next_cursor(response, next_cursor)
     return [fix_id(item) for item in items]
 
+async def text_search_items(query, q, limit, fields):
+    """Up to limit items matching q on the name_brand_text index, best match first"""
+    pipeline = [
+        {"$match": {**query, "$text": {"$search": q}}},
+        {"$sort": {"score": {"$meta": "textScore"}, "_id": 1}},
+        {"$limit": limit},
+        {"$project": api_projection(parse_fields(fields, Item), "_id")}
+    ]
+    return json_response(await db.items.aggregate(pipeline).to_list(limit))
+
+@app.get("/api/items/typeahead", response_model=List[ItemSuggestion])
+async def item_typeahead(
+    q: str = Query(..., max_length=MAX_SEARCH_LENGTH),
+    limit: int = Query(DEFAULT_TYPEAHEAD_SIZE, ge=1, le=MAX_TYPEAHEAD_SIZE)
+):
+    """The first items by name matching q as in get_items, with just what a picker shows"""
+    search = search_filter(q)
+    if search is None:
+        return json_response([])
+    pipeline = [
+        {"$match": search},
+        {"$sort": {"name": 1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": api_projection(["id", "name", "quantity"], "_id")}
+    ]
+    return json_response(await db.items.aggregate(pipeline).to_list(limit))
+
 @app.post("/api/items", response_model=Item)
 async def add_item(item: ItemBase):
     logger.info(f"Adding/updating item: {item.name}")
-    # Check if item exists
-    existing_item = await db.items.find_one({
-        "name": item.name,
-        "brand": item.brand,
-        "type": item.type
+    now = now_ms()
+    # Merge into the existing item or create it in one step; the _id chosen here only
+    # lands in the document on insert, which tells the two cases apart
+    new_id = ObjectId()
+    doc = await db.items.find_one_and_update(
+        item_key(item),
+        item_merge_update(item, now, new_id),
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    inserted = doc["_id"] == new_id
+    logger.info(f"{'Created new' if inserted else 'Updated existing'} item: {item.name}")
+    
+    threshold = doc["lowStockThreshold"]
+    was_low = not inserted and doc["quantity"] - item.quantity < threshold
+    is_low = doc["quantity"] < threshold
+    await record_write(["items"], {
+        "totalItems": int(inserted),
+        "totalStock": item.quantity,
+        "lowStockCount": int(is_low) - int(was_low)
     })
+    response_cache.invalidate("items")
+    if is_low != was_low:
+        publish_event("lowstock", low_stock_event(doc))
+    return fix_id(doc)
+
+@app.post("/api/items/import", response_model=ImportSummary)
+async def import_items(request: Request, format: Optional[Literal["csv", "ndjson"]] = None):
+    """Merge a stream of items into the inventory, with the same semantics as add_item.
+
+    The body is CSV with a header row or NDJSON, one item per line. Rows are parsed as
+    they arrive and written in unordered bulk_write batches of upserts; the next batch
+    is parsed while the previous one is being written.
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    logger.info(f"Importing items ({format})")
+    summary = {"inserted": 0, "merged": 0, "rejected": 0, "errors": []}
     
-    now = datetime.now().isoformat()
+    def reject(line, error):
+        summary["rejected"] += 1
+        if len(summary["errors"]) < MAX_IMPORT_ERRORS:
+            summary["errors"].append({"line": line, "error": error})
     
-    if existing_item:
-        logger.info(f"Updating existing item: {item.name}")
-        # Update quantity
-        result = await db.items.update_one(
-            {"_id": existing_item["_id"]},
-            {"$set": {
-                "quantity": existing_item["quantity"] + item.quantity,
-                "updatedAt": now
-            }}
-        )
-        updated_item = await db.items.find_one({"_id": existing_item["_id"]})
-        return fix_id(updated_item)
-    else:
-        logger.info(f"Creating new item: {item.name}")
-        # Create new item
-        new_item = item.dict()
-        new_item["createdAt"] = now
-        new_item["updatedAt"] = now
-        result = await db.items.insert_one(new_item)
-        created_item = await db.items.find_one({"_id": result.inserted_id})
-        return fix_id(created_item)
+    async def flush(rows):
+        ops = [UpdateOne(item_key(item), item_merge_update(item, now), upsert=True) for _, item in rows]
+        # bulk_write doesn't tell which rows crossed their threshold, so the low items of
+        # the chunk are counted before and after it. A sale of one of them in between is
+        # counted by both, leaving lowStockCount off until the next reconcile_stats
+        chunk_low = {"$or": [item_key(item) for _, item in rows], "isLow": True}
+        low_before = await db.items.count_documents(chunk_low)
+        failed = set()
+        try:
+            result = await db.items.bulk_write(ops, ordered=False)
+            inserted, merged = result.upserted_count, result.matched_count
+        except BulkWriteError as e:
+            inserted, merged = e.details.get("nUpserted", 0), e.details.get("nMatched", 0)
+            for err in e.details["writeErrors"]:
+                failed.add(err["index"])
+                reject(rows[err["index"]][0], err.get("errmsg", "Write failed"))
+        summary["inserted"] += inserted
+        summary["merged"] += merged
+        low_after = await db.items.count_documents(chunk_low)
+        await record_write(["items"], {
+            "totalItems": inserted,
+            "totalStock": sum(item.quantity for i, (_, item) in enumerate(rows) if i not in failed),
+            "lowStockCount": low_after - low_before
+        })
+    
+    now = now_ms()
+    header = None
+    rows = []
+    in_flight = None
+    line_number = 0
+    async for line in iter_body_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            if format == "csv":
+                values = next(csv.reader([line]))
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                if len(values) != len(header):
+                    raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+                row = dict(zip(header, values))
+            else:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+            item = ItemBase(**row)
+        except ValidationError as e:
+            reject(line_number, format_validation_error(e))
+            continue
+        except (ValueError, csv.Error) as e:
+            reject(line_number, str(e))
+            continue
+        
+        rows.append((line_number, item))
+        if len(rows) >= IMPORT_CHUNK_SIZE:
+            if in_flight:
+                await in_flight
+            in_flight = asyncio.create_task(flush(rows))
+            rows = []
+    
+    if in_flight:
+        await in_flight
+    if rows:
+        await flush(rows)
+    if summary["inserted"] or summary["merged"]:
+        response_cache.invalidate("items")
+    logger.info(
+        f"Imported items: {summary['inserted']} inserted, {summary['merged']} merged, "
+        f"{summary['rejected']} rejected"
+    )
+    return summary
 
 # Sales routes
 @app.get("/api/sales", response_model=List[Sale])
-async def get_sales():
-    logger.info("Getting all sales")
-    sales = await db.sales.find().sort("saleDate", -1).to_list(1000)
+async def get_sales(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to"),
+    fields: Optional[str] = None
+):
+    """Sales, newest first, from sales and, for ranges reaching back far enough, the archive"""
+    logger.info("Getting sales")
+    query = date_range_filter("saleDate", start, end)
+    cutoff = await archive_cutoff()
+    if reaches_archive(cutoff, start):
+        sales, next_cursor = await paginate_with_archive(query, start, end, limit, after, cutoff)
+        sales = [fix_id(sale) for sale in sales]
+        if FAST_JSON or fields:
+            names = parse_fields(fields, Sale)
+            response = json_response([{name: sale[name] for name in names} for sale in sales])
+            set_next_cursor(response, next_cursor)
+            return response
+        set_next_cursor(response, next_cursor)
+        return sales
+    if FAST_JSON or fields:
+        return await fast_page(db.sales, query, "saleDate", -1, limit, after, Sale, fields)
+    sales, next_cursor = await paginate(db.sales, query, "saleDate", -1, limit, after)
+    set_next_cursor(response, next_cursor)
     return [fix_id(sale) for sale in sales]
 
 @app.post("/api/sales", response_model=Sale)
 async def add_sale(sale: SaleBase):
     logger.info(f"Adding sale for item ID: {sale.itemId}")
-    # Find the item
+    if sale.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Sale quantity must be positive")
     try:
-        item = await db.items.find_one({"_id": ObjectId(sale.itemId)})
+        item_id = ObjectId(sale.itemId)
     except Exception as e:
-        logger.error(f"Error finding item: {e}")
+        logger.error(f"Error parsing item ID: {e}")
         raise HTTPException(status_code=400, detail=f"Invalid item ID format: {sale.itemId}")
+    
+    now = now_ms()
+
+    async def sell(session):
+        # Check stock and decrement it in one atomic step, so concurrent sales can't oversell
+        item = await db.items.find_one_and_update(
+            {"_id": item_id, "quantity": {"$gte": sale.quantity}},
+            stock_update(-sale.quantity, now),
+            projection={"name": 1, "type": 1, "quantity": 1, "lowStockThreshold": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not item:
+            # Only the failure path pays for a second lookup to pick the right error
+            if await db.items.count_documents({"_id": item_id}, limit=1, session=session):
+                logger.error(f"Insufficient stock for item: {sale.itemId}")
+                raise HTTPException(status_code=400, detail="Insufficient stock")
+            logger.error(f"Item not found with ID: {sale.itemId}")
+            raise HTTPException(status_code=404, detail="Item not found")
         
-    if not item:
-        logger.error(f"Item not found with ID: {sale.itemId}")
-        raise HTTPException(status_code=404, detail="Item not found")
+        # Add sale with a mock price calculation
+        new_sale = {
+            "itemId": sale.itemId,
+            "itemName": item["name"],
+            "quantity": sale.quantity,
+            "total": sale.quantity * SALE_UNIT_PRICE,
+            "saleDate": now
+        }
+        try:
+            await db.sales.insert_one(new_sale, session=session)
+        except Exception:
+            if session is None:
+                # No transaction to roll back, so give the stock back by hand
+                await db.items.update_one({"_id": item_id}, stock_update(sale.quantity, now))
+            raise
+        return item, new_sale
+
+    item, new_sale = await in_transaction(sell)
+    threshold = item["lowStockThreshold"]
+    crossed = item["quantity"] < threshold <= item["quantity"] + sale.quantity
+    # Counters and rollup are shared by every sale, so they are updated after the commit
+    await record_write(["items", "sales"], {"totalStock": -sale.quantity, "lowStockCount": int(crossed)})
+    await update_sales_rollup([new_sale], {sale.itemId: item.get("type")})
+    response_cache.invalidate("items", "sales")
     
-    if item["quantity"] < sale.quantity:
-        logger.error(f"Insufficient stock for item: {sale.itemId}")
-        raise HTTPException(status_code=400, detail="Insufficient stock")
+    if crossed:
+        publish_event("lowstock", low_stock_event(item))
+    # insert_one sets _id on the local document, so there is nothing to read back
+    created_sale = fix_id(new_sale)
+    publish_event("sale", created_sale)
+    return created_sale
+
+@app.post("/api/sales/batch", response_model=SaleBatchResult)
+async def add_sales_batch(batch: SaleBatch):
+    """Record many sales at once.
+
+    Every line is a conditional stock decrement like add_sale's, up to
+    SALE_BATCH_CONCURRENCY of them in flight (one after the other for an ordered batch),
+    and every sale document goes out in one insert_many, whatever the batch size. If
+    any decrement or the insert fails, the stock taken by the applied lines is given
+    back before the error is raised, so the client can retry the whole batch.
+    """
+    lines = batch.sales
+    logger.info(f"Adding batch of {len(lines)} sales (ordered={batch.ordered})")
+    errors = {}
+    item_ids = {}
+    for index, line in enumerate(lines):
+        if line.quantity <= 0:
+            errors[index] = "Sale quantity must be positive"
+            continue
+        try:
+            item_ids[index] = ObjectId(line.itemId)
+        except Exception:
+            errors[index] = f"Invalid item ID format: {line.itemId}"
     
-    # Update item quantity
-    await db.items.update_one(
-        {"_id": item["_id"]},
-        {"$set": {
-            "quantity": item["quantity"] - sale.quantity,
-            "updatedAt": datetime.now().isoformat()
-        }}
-    )
+    # In an ordered batch nothing after the first failing line is applied
+    stop = min(errors) if batch.ordered and errors else len(lines)
+    candidates = [i for i in range(stop) if i not in errors]
     
-    # Add sale with a mock price calculation
-    new_sale = {
-        "itemId": sale.itemId,
-        "itemName": item["name"],
-        "quantity": sale.quantity,
-        "total": sale.quantity * 19.99,  # Mock price calculation
-        "saleDate": datetime.now().isoformat()
+    now = now_ms()
+    in_flight = asyncio.Semaphore(SALE_BATCH_CONCURRENCY)
+
+    async def decrement(i):
+        async with in_flight:
+            return await db.items.find_one_and_update(
+                {"_id": item_ids[i], "quantity": {"$gte": lines[i].quantity}},
+                stock_update(-lines[i].quantity, now),
+                projection={"name": 1, "type": 1, "quantity": 1, "lowStockThreshold": 1},
+                return_document=ReturnDocument.AFTER
+            )
+
+    async def give_back(indexes):
+        # Lines succeed or fail one by one, so batches run without a transaction and
+        # undo their decrements by hand instead
+        if indexes:
+            await db.items.bulk_write([
+                UpdateOne({"_id": item_ids[i]}, stock_update(lines[i].quantity, now))
+                for i in indexes
+            ], ordered=False)
+
+    # Each update reports its own outcome and the stock it left, unlike the counts of a
+    # bulk_write, so lines of the same item fail or succeed one by one
+    items = {}
+    if batch.ordered:
+        try:
+            for i in candidates:
+                items[i] = await decrement(i)
+                if items[i] is None:
+                    break
+        except Exception:
+            await give_back([i for i, item in items.items() if item is not None])
+            raise
+    else:
+        outcomes = await asyncio.gather(*(decrement(i) for i in candidates), return_exceptions=True)
+        items = dict(zip(candidates, outcomes))
+        failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        if failures:
+            await give_back([i for i, item in items.items() if isinstance(item, dict)])
+            raise failures[0]
+    unmatched = [i for i, item in items.items() if item is None]
+    if unmatched:
+        # Only the failure path pays for a lookup to pick the right error
+        existing = set(await db.items.distinct("_id", {"_id": {"$in": list({item_ids[i] for i in unmatched})}}))
+        for i in unmatched:
+            if item_ids[i] in existing:
+                logger.error(f"Insufficient stock for item: {lines[i].itemId}")
+                errors[i] = "Insufficient stock"
+            else:
+                errors[i] = "Item not found"
+    applied = {i: item for i, item in items.items() if item is not None}
+    types = {str(item["_id"]): item.get("type") for item in applied.values()}
+    
+    sale_docs = {
+        i: {
+            "itemId": lines[i].itemId,
+            "itemName": applied[i]["name"],
+            "quantity": lines[i].quantity,
+            "total": lines[i].quantity * SALE_UNIT_PRICE,
+            "saleDate": now
+        }
+        for i in sorted(applied)
     }
+    if sale_docs:
+        try:
+            await db.sales.insert_many(list(sale_docs.values()))
+        except Exception:
+            await give_back(list(sale_docs))
+            raise
+        
+        # A decrement can only take an item below its threshold, never back above it
+        crossings = [
+            low_stock_event(applied[i]) for i in sale_docs
+            if applied[i]["quantity"] < applied[i]["lowStockThreshold"] <= applied[i]["quantity"] + lines[i].quantity
+        ]
+        await record_write(["items", "sales"], {
+            "totalStock": -sum(lines[i].quantity for i in sale_docs),
+            "lowStockCount": len(crossings)
+        })
+        await update_sales_rollup(list(sale_docs.values()), types)
+        response_cache.invalidate("items", "sales")
+        for event in crossings:
+            publish_event("lowstock", event)
     
-    result = await db.sales.insert_one(new_sale)
-    created_sale = await db.sales.find_one({"_id": result.inserted_id})
-    return fix_id(created_sale)
+    first_error = min(errors) if errors else len(lines)
+    results = []
+    for index in range(len(lines)):
+        if index in sale_docs:
+            created_sale = fix_id(sale_docs[index])
+            publish_event("sale", created_sale)
+            results.append({"index": index, "status": "ok", "sale": created_sale})
+        elif index in errors and not (batch.ordered and index > first_error):
+            results.append({"index": index, "status": "error", "error": errors[index]})
+        else:
+            results.append({"index": index, "status": "skipped"})
+    return {
+        "succeeded": len(sale_docs),
+        "failed": len(lines) - len(sale_docs),
+        "results": results
+    }
+
+@app.get("/api/sales/export")
+async def export_sales(
+    format: Literal["csv", "ndjson"] = "ndjson",
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to")
+):
+    """Stream the sales history, oldest first"""
+    logger.info(f"Exporting sales ({format})")
+    query = date_range_filter("saleDate", start, end)
+    cursor = export_cursor(analytics_db.sales, query, "saleDate", SALE_EXPORT_FIELDS)
+    if reaches_archive(await archive_cutoff(), start):
+        cursor = archived_then_hot(start, end, cursor)
+    return export_response(cursor, SALE_EXPORT_FIELDS, format, "sales")
+
+@app.get("/api/sales/monthly", response_model=List[MonthlySalesPoint])
+async def get_monthly_sales(
+    start: Optional[str] = Query(None, alias="from", pattern=MONTH_PATTERN),
+    end: Optional[str] = Query(None, alias="to", pattern=MONTH_PATTERN),
+    itemId: Optional[str] = None,
+    type: Optional[str] = None
+):
+    """Monthly sales totals read straight from the rollup, by default the last six months"""
+    end = end or month_key(datetime.now())
+    start = start or shift_month(end, -5)
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if len(month_span(start, end)) > MAX_ROLLUP_MONTHS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ROLLUP_MONTHS} months per request")
+    logger.info(f"Getting monthly sales {start} to {end}")
+    return await query_sales_rollup(start, end, itemId, type)
+
+# Report routes
+@app.get("/api/reports/top-items", response_model=List[TopItem])
+async def get_top_items_report(
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to"),
+    by: Literal["revenue", "units"] = "revenue",
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Best selling items of the range, by revenue or by units sold"""
+    start, end = report_range(start, end)
+    logger.info(f"Getting top items by {by} from {start} to {end}")
+    return await memoized_report(
+        "top-items", {"from": start, "to": end, "by": by, "limit": limit}, ["sales"],
+        lambda: top_items_report(start, end, by, limit)
+    )
+
+@app.get("/api/reports/revenue-by-type", response_model=List[TypeRevenue])
+async def get_revenue_by_type_report(
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to")
+):
+    """Revenue, units and share of the range's revenue per item type"""
+    start, end = report_range(start, end)
+    logger.info(f"Getting revenue by type from {start} to {end}")
+    return await memoized_report(
+        "revenue-by-type", {"from": start, "to": end}, ["items", "sales"],
+        lambda: revenue_by_type_report(start, end)
+    )
+
+@app.get("/api/reports/comparison", response_model=PeriodComparison)
+async def get_comparison_report(
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to")
+):
+    """Sales totals of the range against the preceding range of the same length"""
+    start, end = report_range(start, end)
+    logger.info(f"Getting period comparison from {start} to {end}")
+    return await memoized_report(
+        "comparison", {"from": start, "to": end}, ["sales"],
+        lambda: comparison_report(start, end)
+    )
+
+@app.get("/api/reports/turnover", response_model=List[ItemTurnover])
+async def get_turnover_report(
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to"),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """Inventory turnover of the items sold in the range, fastest moving first"""
+    start, end = report_range(start, end)
+    logger.info(f"Getting inventory turnover from {start} to {end}")
+    return await memoized_report(
+        "turnover", {"from": start, "to": end, "limit": limit}, ["items", "sales"],
+        lambda: turnover_report(start, end, limit)
+    )
 
 # Cash Flow routes
 @app.get("/api/cashflows", response_model=List[CashFlow])
-async def get_cash_flows():
-    logger.info("Getting all cash flows")
-    cashflows = await db.cashflows.find().sort("date", -1).to_list(1000)
+async def get_cash_flows(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to"),
+    fields: Optional[str] = None
+):
+    logger.info("Getting cash flows")
+    query = date_range_filter("date", start, end)
+    if FAST_JSON or fields:
+        return await fast_page(db.cashflows, query, "date", -1, limit, after, CashFlow, fields)
+    cashflows, next_cursor = await paginate(db.cashflows, query, "date", -1, limit, after)
+    set_next_cursor(response, next_cursor)
     return [fix_id(cf) for cf in cashflows]
 
 @app.post("/api/cashflows", response_model=CashFlow)
 async def add_cash_flow(cashflow: CashFlowBase):
     logger.info(f"Adding cash flow: {cashflow.description}")
     new_cashflow = cashflow.dict()
-    new_cashflow["date"] = datetime.now().isoformat()
+    new_cashflow["date"] = now_ms()
     
-    result = await db.cashflows.insert_one(new_cashflow)
-    created_cashflow = await db.cashflows.find_one({"_id": result.inserted_id})
-    return fix_id(created_cashflow)
+    await db.cashflows.insert_one(new_cashflow)
+    delta = cashflow.amount if cashflow.isInflow else -cashflow.amount
+    await record_write(["cashflows"], {"cashBalance": delta})
+    response_cache.invalidate("cashflows")
+    created_cashflow = fix_id(new_cashflow)
+    publish_event("cashflow", created_cashflow)
+    return created_cashflow
+
+@app.get("/api/cashflows/export")
+async def export_cash_flows(
+    format: Literal["csv", "ndjson"] = "ndjson",
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to")
+):
+    """Stream the cash flow history, oldest first"""
+    logger.info(f"Exporting cash flows ({format})")
+    query = date_range_filter("date", start, end)
+    cursor = export_cursor(analytics_db.cashflows, query, "date", CASHFLOW_EXPORT_FIELDS)
+    return export_response(cursor, CASHFLOW_EXPORT_FIELDS, format, "cashflows")
+
+@app.get("/api/cashflows/balance", response_model=CashBalance)
+async def get_cash_balance(as_of: Optional[DateParam] = Query(None, alias="asOf")):
+    """Balance of the cash flows dated before asOf, by default of all of them so far"""
+    as_of = to_local_naive(as_of) if as_of is not None else now_ms()
+    logger.info(f"Getting cash balance as of {as_of}")
+    totals = (await cash_totals([as_of], analytics_db))[0]
+    return {"asOf": as_of.isoformat(), **{key: round(value, 2) for key, value in totals.items()}}
+
+@app.get("/api/cashflows/balance/series", response_model=List[BalancePoint])
+async def get_cash_balance_series(
+    start: Optional[DateParam] = Query(None, alias="from"),
+    end: Optional[DateParam] = Query(None, alias="to"),
+    interval: Literal["day", "month"] = "day"
+):
+    """Flows and closing balance of every day or month overlapping [from, to), for charts.
+
+    By default the last 30 days through today. The period still in progress closes with
+    the balance so far.
+    """
+    start, end = report_range(start, end)
+    boundaries = [period_start(start, interval)]
+    while boundaries[-1] < end:
+        if len(boundaries) > MAX_BALANCE_POINTS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BALANCE_POINTS} points per request")
+        boundaries.append(next_period(boundaries[-1], interval))
+    logger.info(f"Getting {interval} cash balance series from {start} to {end}")
+    totals = await cash_totals(boundaries, analytics_db)
+    # Amounts are money; differences of running sums would otherwise show float noise
+    return [
+        {
+            "start": opened.isoformat(),
+            "end": closed.isoformat(),
+            "inflows": round(closing["inflows"] - opening["inflows"], 2),
+            "outflows": round(closing["outflows"] - opening["outflows"], 2),
+            "balance": round(closing["balance"], 2)
+        }
+        for opened, closed, opening, closing in zip(boundaries, boundaries[1:], totals, totals[1:])
+    ]
 
 # Low Stock Items
 @app.get("/api/lowstock", response_model=List[Item])
-async def get_low_stock_items():
+async def get_low_stock_items(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """Low stock items, most severe first: sold out, then by the share of the threshold left"""
     logger.info("Getting low stock items")
-    pipeline = [
-        {"$match": {"$expr": {"$lt": ["$quantity", "$lowStockThreshold"]}}},
-    ]
-    low_stock_items = await db.items.aggregate(pipeline).to_list(1000)
-    return [fix_id(item) for item in low_stock_items]
+    if FAST_JSON or fields:
+        return await fast_page(db.items, {"isLow": True}, "lowStockRatio", 1, limit, after, Item, fields)
+    items, next_cursor = await paginate(db.items, {"isLow": True}, "lowStockRatio", 1, limit, after)
+    set_next_cursor(response, next_cursor)
+    return [fix_id(item) for item in items]
+
+# Demand forecast
+@app.get("/api/forecast", response_model=ForecastReport)
+async def get_forecast(
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    needs_reorder: bool = Query(False, alias="needsReorder"),
+    item_id: Optional[str] = Query(None, alias="itemId")
+):
+    """Items by days until stockout, soonest first, from the latest background forecast"""
+    logger.info("Getting demand forecast")
+    report = forecaster.report(limit, needs_reorder, item_id)
+    if report is None:
+        raise HTTPException(status_code=503, detail="Forecast not computed yet")
+    return report
+
+@app.post("/api/forecast/refresh", response_model=ForecastReport)
+async def refresh_demand_forecast(limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """Recompute the forecast now rather than at the next scheduled run"""
+    logger.info("Refreshing demand forecast")
+    await refresh_forecast()
+    return forecaster.report(limit)
 
 # Dashboard stats
+async def timed(label, awaitable, timings):
+    """Await and record the elapsed milliseconds under label"""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[label] = (time.perf_counter() - started) * 1000
+
 @app.get("/api/dashboard", response_model=DashboardStats)
-async def get_dashboard_stats():
+async def get_dashboard_stats(response: Response):
     logger.info("Getting dashboard stats")
-    # Get total items and stock
-    items_count = await db.items.count_documents({})
-    
-    pipeline = [
-        {"$group": {"_id": None, "totalStock": {"$sum": "$quantity"}}}
-    ]
-    stock_result = await db.items.aggregate(pipeline).to_list(1)
-    total_stock = stock_result[0]["totalStock"] if stock_result else 0
-    
-    # Get low stock count
-    low_stock_count = await db.items.count_documents(
-        {"$expr": {"$lt": ["$quantity", "$lowStockThreshold"]}}
+    timings = {}
+    # KPI counters and the monthly chart are point reads; all three queries run at once.
+    # The counters come from the primary, the sales lists from the analytics read preference
+    this_month = month_key(datetime.now())
+    first_month = shift_month(this_month, -5)
+    stats, recent_sales, monthly_sales_data = await asyncio.gather(
+        timed("stats", db["stats"].find_one({"_id": STATS_ID}), timings),
+        timed("recentSales", analytics_db.sales.find().sort([("saleDate", -1), ("_id", -1)]).limit(5).to_list(5), timings),
+        timed("monthlySales", analytics_db.sales_monthly.find(
+            {"itemId": None, "month": {"$gte": first_month, "$lte": this_month}}
+        ).to_list(6), timings)
     )
+    if not (stats and stats.get("reconciled")):
+        stats = (await timed("reconcile", reconcile_stats(), timings))["counters"]
+    if DEBUG:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{label};dur={ms:.1f}" for label, ms in timings.items()
+        )
+        logger.info(f"Dashboard query timings (ms): {timings}")
     
-    # Get cash balance
-    inflow_pipeline = [
-        {"$match": {"isInflow": True}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]
-    
-    outflow_pipeline = [
-        {"$match": {"isInflow": False}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]
-    
-    inflows_result = await db.cashflows.aggregate(inflow_pipeline).to_list(1)
-    outflows_result = await db.cashflows.aggregate(outflow_pipeline).to_list(1)
-    
-    inflows = inflows_result[0]["total"] if inflows_result else 0
-    outflows = outflows_result[0]["total"] if outflows_result else 0
-    cash_balance = inflows - outflows
-    
-    # Get recent sales
-    recent_sales = await db.sales.find().sort("saleDate", -1).limit(5).to_list(5)
+    # A shop that has been quiet for longer than the archive horizon has its last sales there
+    if len(recent_sales) < 5 and stats and stats.get("salesArchivedBefore"):
+        archived = await archived_sales(None, None, 5, None)
+        recent_sales = sorted(recent_sales + archived, key=sale_order, reverse=True)[:5]
     recent_sales = [fix_id(sale) for sale in recent_sales]
     
-    # Generate monthly sales data based on actual data
-    pipeline = [
-        {
-            "$group": {
-                "_id": {"$substr": ["$saleDate", 0, 7]},  # Group by YYYY-MM
-                "total": {"$sum": "$total"}
-            }
-        },
-        {"$sort": {"_id": 1}},  # Sort by date
-        {"$limit": 6}  # Get last 6 months
-    ]
-    
-    monthly_sales_data = await db.sales.aggregate(pipeline).to_list(6)
-    
-    # Format the monthly sales data
+    # Format the monthly sales data: the last six months, oldest first
     monthly_sales = []
     
     # If we have real data, use it
     if monthly_sales_data:
-        for item in monthly_sales_data:
+        totals = {doc["month"]: doc["total"] for doc in monthly_sales_data}
+        for month in month_span(first_month, this_month):
             # Convert YYYY-MM to month name
-            try:
-                year_month = item["_id"].split("-")
-                month_num = int(year_month[1])
-                month_name = datetime(2000, month_num, 1).strftime("%b")
-                monthly_sales.append({"month": month_name, "total": item["total"]})
-            except Exception as e:
-                logger.error(f"Error formatting monthly sales: {e}")
+            month_name = datetime(2000, int(month[5:]), 1).strftime("%b")
+            monthly_sales.append({"month": month_name, "total": totals.get(month, 0)})
     
     # If no real data, use mock data
     if not monthly_sales:
@@ -462,53 +2551,114 @@ async def get_dashboard_stats():
         ]
     
     return {
-        "totalItems": items_count,
-        "totalStock": total_stock,
-        "lowStockCount": low_stock_count,
-        "cashBalance": cash_balance,
+        "totalItems": stats["totalItems"],
+        "totalStock": stats["totalStock"],
+        "lowStockCount": stats["lowStockCount"],
+        "cashBalance": stats["cashBalance"],
         "recentSales": recent_sales,
         "monthlySales": monthly_sales
     }
 
+@app.post("/api/stats/reconcile")
+async def reconcile_dashboard_stats():
+    """Recompute the dashboard counters from scratch and report any drift"""
+    logger.info("Reconciling dashboard stats")
+    return await reconcile_stats()
+
+@app.get("/api/events")
+async def stream_events(request: Request):
+    """Server-sent events: sale, cashflow, and lowstock when an item crosses its threshold"""
+    logger.info("Client subscribed to events")
+    return StreamingResponse(
+        sse_stream(event_bus, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/events/stats")
+async def get_event_stats():
+    return {"source": EVENTS_SOURCE, **event_bus.stats()}
+
+@app.get("/api/pool/stats")
+async def get_pool_stats():
+    """MongoDB connection pool occupancy and checkout counts, by server"""
+    return {
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "compressors": MONGODB_COMPRESSORS.split(",") if MONGODB_COMPRESSORS else [],
+        "analyticsReadPreference": ANALYTICS_READ_PREFERENCE,
+        "servers": pool_metrics.stats()
+    }
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters of the response cache and of the report memo"""
+    return {**response_cache.stats(), "reports": report_cache.stats()}
+
+# Prometheus metrics
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 # Root endpoint
 @app.get("/")
 async def root():
     return {"message": "Welcome to the StockFlow API"}
 
-# Simple health check endpoint to verify MongoDB connection
-@app.get("/health")
-async def health():
+# Health checks
+async def refresh_health():
+    """Keep the readiness counts current with cheap metadata-based counts"""
+    while True:
+        try:
+            names = ("items", "sales", "cashflows")
+            counts = await asyncio.gather(*(db[name].estimated_document_count() for name in names))
+            health_state.update(
+                collections=dict(zip(names, counts)),
+                checkedAt=datetime.now(),
+                refreshed=time.monotonic(),
+                error=None
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Health refresh failed: {e}")
+            health_state["error"] = str(e)
+        await asyncio.sleep(HEALTH_REFRESH_INTERVAL)
+
+@app.get("/health/live")
+async def liveness(response: Response):
+    """Liveness probe: a single ping"""
     try:
-        if not client:
-            return {"status": "error", "message": "MongoDB client not initialized"}
-            
-        # Ping the database
-        await client.admin.command('ping')
-        
-        # Get database stats
-        db_stats = await db.command("dbstats")
-        
-        # Get collection counts
-        items_count = await db.items.count_documents({})
-        sales_count = await db.sales.count_documents({})
-        cashflows_count = await db.cashflows.count_documents({})
-        
+        await client.admin.command("ping")
+    except Exception as e:
+        logger.error(f"Liveness check failed: {e}")
+        response.status_code = 503
+        return {"status": "error", "message": str(e)}
+    return {"status": "alive"}
+
+@app.get("/health")
+@app.get("/health/ready")
+async def health(response: Response):
+    """Readiness probe, answered from the state refresh_health keeps without touching MongoDB"""
+    refreshed = health_state["refreshed"]
+    if refreshed is None:
+        message = "Starting up"
+    elif health_state["error"]:
+        message = health_state["error"]
+    elif time.monotonic() - refreshed > 3 * HEALTH_REFRESH_INTERVAL:
+        message = "Health state is stale"
+    else:
         return {
             "status": "healthy",
             "mongodb": "connected",
             "database": DATABASE_NAME,
-            "collections": {
-                "items": items_count,
-                "sales": sales_count,
-                "cashflows": cashflows_count
-            }
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return {
-            "status": "error",
-            "message": str(e)
+            "collections": health_state["collections"],
+            "checkedAt": health_state["checkedAt"].isoformat()
         }
+    response.status_code = 503
+    return {"status": "error", "message": message}
 
 if __name__ == "__main__":
     import uvicorn
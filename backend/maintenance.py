@@ -0,0 +1,156 @@
+"""
+Maintenance commands for the StockFlow database.
+
+Usage:
+    python maintenance.py reconcile-stats
+    python maintenance.py rebuild-monthly-sales
+    python maintenance.py migrate-dates [--batch-size N] [--pause SECONDS]
+    python maintenance.py backfill-lowstock [--batch-size N]
+    python maintenance.py backfill-search-terms [--batch-size N]
+    python maintenance.py archive-sales --days N [--batch-size N]
+    python maintenance.py rebuild-cash-snapshots [--period day|month]
+"""
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+import main
+
+logger = logging.getLogger(__name__)
+
+async def reconcile_stats(args):
+    """Recompute the dashboard counters and print the drift that was corrected"""
+    report = await main.reconcile_stats()
+    logger.info(f"Counters: {report['counters']}")
+    if not report["existed"]:
+        logger.info("Stats document did not exist and has been created")
+    elif report["drift"]:
+        logger.warning(f"Corrected drift: {report['drift']}")
+    else:
+        logger.info("No drift")
+
+async def rebuild_monthly_sales(args):
+    """Backfill the sales_monthly rollup from the full sales history"""
+    months = await main.rebuild_sales_rollup()
+    logger.info(f"Monthly sales rollup covers {months} months")
+
+async def backfill_lowstock(args):
+    """Recompute the isLow flag and severity ratio of every item"""
+    updated = await main.backfill_low_stock_flags(args.batch_size)
+    logger.info(f"Low stock flags changed on {updated} items")
+
+async def backfill_search_terms(args):
+    """Recompute the indexed search words of every item"""
+    updated = await main.backfill_search_terms(args.batch_size)
+    logger.info(f"Search terms changed on {updated} items")
+
+async def archive_sales(args):
+    """Move sales older than --days days into the sales_archive buckets"""
+    if "sales_archive" not in await main.db.list_collection_names():
+        await main.create_sales_archive()
+    # Replayed batches are only caught by the unique bucket index
+    await main.ensure_indexes()
+    moved = await main.archive_sales(args.days, args.batch_size)
+    logger.info(f"Archived {moved} sales")
+
+async def rebuild_cash_snapshots(args):
+    """Rewrite the cash balance snapshots from all cash flows"""
+    written = await main.rebuild_cash_snapshots(args.period)
+    logger.info(f"Wrote {written} cash balance snapshots")
+
+# Timestamp fields that used to be written as ISO strings
+DATE_FIELDS = {
+    "items": ["createdAt", "updatedAt"],
+    "sales": ["saleDate"],
+    "cashflows": ["date"],
+}
+
+async def migrate_dates(args):
+    """Convert ISO string timestamps to BSON dates in batches while the API keeps running.
+
+    Each batch is one read and one unordered bulk_write. Updates are conditional on the
+    string still being there, so documents written in the meantime are never clobbered.
+    """
+    for collection_name, fields in DATE_FIELDS.items():
+        collection = main.db[collection_name]
+        for field in fields:
+            converted = failed = 0
+            last_id = None
+            while True:
+                query = {field: {"$type": "string"}}
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                docs = await collection.find(query, {field: 1}).sort("_id", 1).limit(args.batch_size).to_list(None)
+                if not docs:
+                    break
+                last_id = docs[-1]["_id"]
+                ops = []
+                for doc in docs:
+                    try:
+                        value = datetime.fromisoformat(doc[field])
+                    except ValueError:
+                        failed += 1
+                        logger.error(f"Cannot parse {collection_name}.{field} of {doc['_id']}: {doc[field]!r}")
+                        continue
+                    ops.append(UpdateOne(
+                        {"_id": doc["_id"], field: doc[field]},
+                        {"$set": {field: main.to_local_naive(value)}}
+                    ))
+                if ops:
+                    result = await collection.bulk_write(ops, ordered=False)
+                    converted += result.modified_count
+                logger.info(f"{collection_name}.{field}: {converted} converted so far")
+                if args.pause:
+                    await asyncio.sleep(args.pause)
+            logger.info(f"{collection_name}.{field}: {converted} converted, {failed} unparseable")
+
+# name: (handler, help, [(flags, argparse options)])
+COMMANDS = {
+    "reconcile-stats": (reconcile_stats, "Recompute the dashboard KPI counters from scratch", []),
+    "rebuild-monthly-sales": (rebuild_monthly_sales, "Backfill the monthly sales rollup from all sales", []),
+    "migrate-dates": (migrate_dates, "Convert ISO string timestamps to BSON dates", [
+        (["--batch-size"], {"type": int, "default": 1000, "help": "documents per batch"}),
+        (["--pause"], {"type": float, "default": 0, "help": "seconds to sleep between batches"}),
+    ]),
+    "backfill-lowstock": (backfill_lowstock, "Set the indexed low stock flag on every item", [
+        (["--batch-size"], {"type": int, "default": 1000, "help": "items per update"}),
+    ]),
+    "backfill-search-terms": (backfill_search_terms, "Set the indexed search words of every item", [
+        (["--batch-size"], {"type": int, "default": 1000, "help": "items per update"}),
+    ]),
+    "rebuild-cash-snapshots": (rebuild_cash_snapshots, "Rewrite the cash balance snapshots from all cash flows", [
+        (["--period"], {"choices": ["day", "month"], "default": main.CASH_SNAPSHOT_PERIOD, "help": "snapshot period"}),
+    ]),
+    "archive-sales": (archive_sales, "Move old sales into the per-item per-day archive buckets", [
+        (["--days"], {"type": int, "default": main.SALES_ARCHIVE_DAYS or None, "required": not main.SALES_ARCHIVE_DAYS,
+                      "help": "archive the sales of whole days older than this (default SALES_ARCHIVE_DAYS)"}),
+        (["--batch-size"], {"type": int, "default": 1000, "help": "sales per batch"}),
+    ]),
+}
+
+async def run(args):
+    main.client = AsyncIOMotorClient(main.MONGODB_URI, serverSelectionTimeoutMS=5000)
+    main.db = main.client[main.DATABASE_NAME]
+    try:
+        await main.client.server_info()
+        logger.info(f"Connected to MongoDB, using database: {main.DATABASE_NAME}")
+        await COMMANDS[args.command][0](args)
+    finally:
+        main.client.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="StockFlow maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text, arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        for flags, options in arguments:
+            subparser.add_argument(*flags, **options)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,208 @@
+"""
+Prometheus metrics for the API and its MongoDB traffic.
+
+MetricsMiddleware times every request by route template and tracks the requests in
+flight. The pymongo listeners record the latency and failures of every command sent
+to MongoDB, by collection and command name, how long requests wait to check a
+connection out of the pool and how many pooled connections are open and in use. All of it is rendered by the /metrics route.
+"""
+
+import threading
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.routing import Match
+
+# MongoDB operations are mostly sub-millisecond, so the buckets start lower than the default
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    "stockflow_http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "stockflow_http_requests_in_progress",
+    "Requests being handled, including open event streams",
+    ["method", "route"]
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "stockflow_mongo_command_duration_seconds",
+    "Round trip time of MongoDB commands",
+    ["collection", "command"],
+    buckets=MONGO_BUCKETS
+)
+MONGO_COMMAND_ERRORS = Counter(
+    "stockflow_mongo_command_errors_total",
+    "MongoDB commands that failed",
+    ["collection", "command", "code"]
+)
+MONGO_POOL_CHECKOUT = Histogram(
+    "stockflow_mongo_pool_checkout_seconds",
+    "Time spent waiting for a connection from the MongoDB pool",
+    ["address"],
+    buckets=MONGO_BUCKETS
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "stockflow_mongo_pool_checkout_failures_total",
+    "Connection checkouts that failed, by reason",
+    ["address", "reason"]
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "stockflow_mongo_pool_connections",
+    "Pooled connections that are open, checked out, and requests waiting for one",
+    ["address", "state"]
+)
+
+def route_label(scope):
+    """Path template of the route serving a request, so labels stay bounded"""
+    app = scope.get("app")
+    for route in getattr(app, "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request until its response is complete.
+
+    Plain ASGI rather than BaseHTTPMiddleware, so streamed responses are timed to their
+    last chunk and an open event stream counts as in progress for as long as it lasts.
+    """
+
+    def __init__(self, app, exclude=("/metrics",)):
+        self.app = app
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_label(scope)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - started)
+
+class CommandMetrics(monitoring.CommandListener):
+    """Latency and errors of every MongoDB command, by collection and command name"""
+
+    def __init__(self):
+        # Started events carry the command document, the completion events only its
+        # request id, so remember which collection each in-flight command targets
+        self.collections = {}
+
+    def started(self, event):
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        else:
+            target = event.command.get(event.command_name) if event.command else None
+        self.collections[event.request_id] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        collection = self.collections.pop(event.request_id, "")
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.collections.pop(event.request_id, "")
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        code = event.failure.get("code", "") if isinstance(event.failure, dict) else ""
+        MONGO_COMMAND_ERRORS.labels(collection, event.command_name, str(code)).inc()
+
+# Pool statistics fields mirrored in the stockflow_mongo_pool_connections gauge
+POOL_GAUGE_STATES = {"open": "open", "inUse": "in_use", "waiting": "waiting"}
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection checkout wait times and pool occupancy, per server.
+
+    A checkout starts and finishes on the same thread, so its start time is kept in a
+    thread local. Listeners run on whichever thread uses the pool, hence the lock.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pools = {}
+
+    def adjust(self, address, **deltas):
+        key = f"{address[0]}:{address[1]}"
+        with self.lock:
+            pool = self.pools.setdefault(key, {
+                "open": 0, "inUse": 0, "waiting": 0, "checkouts": 0, "failedCheckouts": 0
+            })
+            for field, delta in deltas.items():
+                pool[field] += delta
+                if field in POOL_GAUGE_STATES:
+                    MONGO_POOL_CONNECTIONS.labels(key, POOL_GAUGE_STATES[field]).set(pool[field])
+        return key
+
+    def stats(self):
+        """Current pool statistics by server address"""
+        with self.lock:
+            return {key: dict(pool) for key, pool in self.pools.items()}
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+        self.adjust(event.address, waiting=1)
+
+    def connection_checked_out(self, event):
+        key = self.adjust(event.address, waiting=-1, inUse=1, checkouts=1)
+        started = getattr(self.local, "started", None)
+        if started is not None:
+            MONGO_POOL_CHECKOUT.labels(key).observe(time.perf_counter() - started)
+            self.local.started = None
+
+    def connection_check_out_failed(self, event):
+        self.local.started = None
+        key = self.adjust(event.address, waiting=-1, failedCheckouts=1)
+        MONGO_POOL_CHECKOUT_FAILURES.labels(key, str(event.reason)).inc()
+
+    def connection_checked_in(self, event):
+        self.adjust(event.address, inUse=-1)
+
+    def connection_created(self, event):
+        self.adjust(event.address, open=1)
+
+    def connection_closed(self, event):
+        self.adjust(event.address, open=-1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+# Shared by every client of the process, so /api/pool/stats sees all of them
+pool_metrics = PoolMetrics()
+
+def mongo_listeners():
+    """Listeners to pass as event_listeners when creating the MongoDB client"""
+    return [CommandMetrics(), pool_metrics]
+
+def render_metrics():
+    """The default registry in the Prometheus text format, with its content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,17 +1,35 @@
-
 """
 Script to seed the MongoDB database with sample data for all collections.
 This will populate data for all pages of the StockFlow application.
+
+Without arguments it replaces the data with a small sample (20 items, 50 sales,
+40 cash flows). Counts can go into the millions for production-sized data sets:
+
+    python seed_data.py --items 50000 --sales 5000000 --cashflows 200000 --seed 7
+    python seed_data.py --sales 1000000 --mode append
+
+Documents are generated lazily and written in concurrent unordered insert_many
+batches. Item popularity follows a Zipf distribution and sale dates follow a
+seasonal curve, so the data has the skew real stores see. The same --seed and
+--end-date give the same data.
 """
 
+import argparse
 import asyncio
+import itertools
+import math
 import os
+import time
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
 from dotenv import load_dotenv
 import logging
 import random
 
+import main
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,167 +41,283 @@ load_dotenv()
 MONGODB_URI = os.getenv("MONGODB_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "stockflow")
 
+CATEGORIES = {
+    "Clothing": ["T-Shirt", "Jeans", "Hoodie", "Jacket", "Socks", "Hat"],
+    "Electronics": ["Phone", "Laptop", "Tablet", "Headphones", "Speaker", "Charger"],
+    "Home": ["Pillow", "Lamp", "Vase", "Frame", "Candle", "Rug"],
+    "Books": ["Fiction", "Non-Fiction", "Biography", "Cookbook", "Self-Help"],
+    "Beauty": ["Shampoo", "Lotion", "Cream", "Perfume", "Makeup"],
+    "Food": ["Snack", "Cereal", "Coffee", "Tea", "Spices"],
+    "Toys": ["Doll", "Car", "Puzzle", "Game", "Blocks"]
+}
+BRANDS = ["TopBrand", "Quality Co", "Premium", "Standard", "Luxury", "Basic", "Elite"]
+INFLOW_DESCRIPTIONS = [
+    "Sales revenue", "Investment", "Refund", "Online orders",
+    "Wholesale purchase", "Business loan", "Tax refund"
+]
+OUTFLOW_DESCRIPTIONS = [
+    "Rent", "Utilities", "Salaries", "Inventory purchase",
+    "Equipment", "Marketing", "Insurance", "Maintenance"
+]
+
+# Most sales are of one or two units
+SALE_QUANTITIES = [1, 2, 3, 4, 5]
+SALE_QUANTITY_WEIGHTS = [50, 25, 12, 8, 5]
+
+def object_id(rng, timestamp):
+    """ObjectId with the given creation time and rng-drawn remaining bytes, so ids follow the seed"""
+    return ObjectId(int(timestamp.timestamp()).to_bytes(4, "big") + rng.randbytes(8))
+
+def seasonal_day_weights(end, days):
+    """Relative sales volume of each of the days before end.
+
+    A yearly wave peaking in December, a pre-Christmas rush and busier weekends.
+    """
+    weights = []
+    for offset in range(days):
+        day = end - timedelta(days=days - offset)
+        weight = 1 + 0.3 * math.cos(2 * math.pi * (day.timetuple().tm_yday - 350) / 365.25)
+        if day.month == 12 and day.day <= 24:
+            weight *= 1.5
+        if day.weekday() >= 5:
+            weight *= 1.3
+        weights.append(weight)
+    return list(itertools.accumulate(weights))
+
+def random_moment(rng, end, days, day_weights):
+    """A time during opening hours (9:00-21:00) on a day drawn from the seasonal curve"""
+    offset = rng.choices(range(days), cum_weights=day_weights)[0]
+    day = (end - timedelta(days=days - offset)).replace(hour=9, minute=0, second=0, microsecond=0)
+    return day + timedelta(seconds=rng.randrange(12 * 3600))
+
 # Create data generators
-def generate_items(n=20):
-    """Generate sample items"""
-    categories = ["Clothing", "Electronics", "Home", "Books", "Beauty", "Food", "Toys"]
-    brands = ["TopBrand", "Quality Co", "Premium", "Standard", "Luxury", "Basic", "Elite"]
-    
-    items = []
-    for i in range(1, n+1):
-        category = random.choice(categories)
-        item_type = {
-            "Clothing": ["T-Shirt", "Jeans", "Hoodie", "Jacket", "Socks", "Hat"],
-            "Electronics": ["Phone", "Laptop", "Tablet", "Headphones", "Speaker", "Charger"],
-            "Home": ["Pillow", "Lamp", "Vase", "Frame", "Candle", "Rug"],
-            "Books": ["Fiction", "Non-Fiction", "Biography", "Cookbook", "Self-Help"],
-            "Beauty": ["Shampoo", "Lotion", "Cream", "Perfume", "Makeup"],
-            "Food": ["Snack", "Cereal", "Coffee", "Tea", "Spices"],
-            "Toys": ["Doll", "Car", "Puzzle", "Game", "Blocks"]
-        }[category]
-        
-        quantity = random.randint(1, 100)
-        threshold = random.randint(5, 20)
-        
+def iter_items(n, rng, start=1, end=None):
+    """Generate n items lazily, named with consecutive numbers from start"""
+    end = end or datetime.now()
+    for i in range(start, start + n):
+        category = rng.choice(list(CATEGORIES))
+        quantity = rng.randint(1, 100)
+        threshold = rng.randint(5, 20)
+
         # Ensure some items have low stock for testing notifications
         if i % 5 == 0:
-            quantity = random.randint(1, threshold - 1)
-            
-        items.append({
-            "name": f"{random.choice(item_type)} {i}",
-            "brand": f"{random.choice(brands)}",
+            quantity = rng.randint(1, threshold - 1)
+
+        created_at = end - timedelta(days=rng.randint(1, 90))
+        name = f"{rng.choice(CATEGORIES[category])} {i}"
+        brand = rng.choice(BRANDS)
+        item = {
+            "_id": object_id(rng, created_at),
+            "name": name,
+            "brand": brand,
             "type": category,
             "quantity": quantity,
             "lowStockThreshold": threshold,
-            "createdAt": (datetime.now() - timedelta(days=random.randint(1, 90))).isoformat(),
-            "updatedAt": datetime.now().isoformat()
-        })
-    
-    return items
+            # Written directly rather than backfilled, same values as main.LOW_STOCK_FIELDS
+            "isLow": quantity < threshold,
+            "createdAt": created_at.replace(microsecond=0),
+            "updatedAt": end.replace(microsecond=0),
+            "searchTerms": main.search_terms(name, brand)
+        }
+        if item["isLow"]:
+            item["lowStockRatio"] = quantity / max(threshold, 1)
+        yield item
 
-def generate_sales(items, n=50):
-    """Generate sample sales based on items"""
-    sales = []
-    
-    for i in range(n):
-        item = random.choice(items)
-        item_id = str(item["_id"])
-        quantity = random.randint(1, 5)
-        price = random.uniform(9.99, 99.99)
-        days_ago = random.randint(0, 180)  # Sales over past 6 months
-        
-        sales.append({
+def iter_sales(items, n, rng, days=180, zipf=1.1, end=None):
+    """Generate n sales lazily over the given (itemId, itemName) pairs.
+
+    Items are ranked in random order and the item of each sale is drawn with weight
+    1 / rank ** zipf, so a few items take most of the sales, as in a real shop.
+    """
+    end = end or datetime.now()
+    ranked = list(items)
+    rng.shuffle(ranked)
+    item_weights = list(itertools.accumulate(1 / rank ** zipf for rank in range(1, len(ranked) + 1)))
+    day_weights = seasonal_day_weights(end, days)
+    for _ in range(n):
+        item_id, item_name = rng.choices(ranked, cum_weights=item_weights)[0]
+        quantity = rng.choices(SALE_QUANTITIES, weights=SALE_QUANTITY_WEIGHTS)[0]
+        sale_date = random_moment(rng, end, days, day_weights)
+        yield {
+            "_id": object_id(rng, sale_date),
             "itemId": item_id,
-            "itemName": item["name"],
+            "itemName": item_name,
             "quantity": quantity,
-            "total": round(quantity * price, 2),
-            "saleDate": (datetime.now() - timedelta(days=days_ago)).isoformat()
-        })
-    
-    return sales
+            "total": round(quantity * rng.uniform(9.99, 99.99), 2),
+            "saleDate": sale_date
+        }
+
+def iter_cashflows(n, rng, days=180, end=None):
+    """Generate n cash flows lazily, dated along the same seasonal curve as sales"""
+    end = end or datetime.now()
+    day_weights = seasonal_day_weights(end, days)
+    for _ in range(n):
+        is_inflow = rng.random() < 0.5
+        descriptions = INFLOW_DESCRIPTIONS if is_inflow else OUTFLOW_DESCRIPTIONS
+        date = random_moment(rng, end, days, day_weights)
+        yield {
+            "_id": object_id(rng, date),
+            "description": rng.choice(descriptions),
+            "amount": round(rng.uniform(100, 5000), 2),
+            "isInflow": is_inflow,
+            "date": date
+        }
+
+def generate_items(n=20):
+    """Generate sample items"""
+    return list(iter_items(n, random))
+
+def generate_sales(items, n=50):
+    """Generate sample sales based on items"""
+    return list(iter_sales([(str(item["_id"]), item["name"]) for item in items], n, random))
 
 def generate_cashflows(n=40):
     """Generate sample cash flows"""
-    inflow_descriptions = [
-        "Sales revenue", "Investment", "Refund", "Online orders",
-        "Wholesale purchase", "Business loan", "Tax refund"
-    ]
-    
-    outflow_descriptions = [
-        "Rent", "Utilities", "Salaries", "Inventory purchase", 
-        "Equipment", "Marketing", "Insurance", "Maintenance"
-    ]
-    
-    cashflows = []
-    
-    for i in range(n):
-        is_inflow = random.choice([True, False])
-        descriptions = inflow_descriptions if is_inflow else outflow_descriptions
-        amount = round(random.uniform(100, 5000), 2)
-        days_ago = random.randint(0, 180)  # Cash flows over past 6 months
-        
-        cashflows.append({
-            "description": random.choice(descriptions),
-            "amount": amount,
-            "isInflow": is_inflow,
-            "date": (datetime.now() - timedelta(days=days_ago)).isoformat()
-        })
-    
-    return cashflows
+    return list(iter_cashflows(n, random))
+
+class Progress:
+    """Log inserted documents and throughput every few seconds"""
+
+    def __init__(self, label, total, interval=2.0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = self.last_report = time.perf_counter()
+
+    def add(self, count):
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            logger.info(
+                f"{self.label}: {self.done}/{self.total} ({self.done / self.total:.0%}), "
+                f"{self.done / (now - self.started):,.0f} docs/sec"
+            )
+
+    def finish(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        logger.info(f"Inserted {self.done} {self.label} in {elapsed:.1f}s, {self.done / elapsed:,.0f} docs/sec")
+
+async def insert_lazily(collection, docs, total, batch_size, concurrency):
+    """Insert documents from an iterator in unordered insert_many batches, several at a time.
+
+    The next batch is generated while earlier ones are in flight. Duplicates (e.g. a name
+    already used in append mode) are skipped by the unordered insert and not counted.
+    """
+    progress = Progress(collection.name, total)
 
-async def seed_database():
+    async def insert(batch):
+        try:
+            result = await collection.insert_many(batch, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            return e.details["nInserted"]
+
+    pending = set()
+    docs = iter(docs)
+    while batch := list(itertools.islice(docs, batch_size)):
+        if len(pending) >= concurrency:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                progress.add(task.result())
+        pending.add(asyncio.create_task(insert(batch)))
+    for task in asyncio.as_completed(pending):
+        progress.add(await task)
+    progress.finish()
+    return progress.done
+
+async def seed_database(args):
     """Main function to seed the database with sample data"""
     try:
         # Connect to MongoDB
         logger.info(f"Connecting to MongoDB: {MONGODB_URI}")
         client = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        
+
         # Force connection
         await client.server_info()
         logger.info("Successfully connected to MongoDB")
-        
+
         # Get database
         db = client[DATABASE_NAME]
         logger.info(f"Using database: {DATABASE_NAME}")
-        
-        # Check existing collections
-        collections = await db.list_collection_names()
-        logger.info(f"Existing collections: {collections}")
-        
-        # Clear existing data
-        if "items" in collections:
-            await db.items.delete_many({})
-            logger.info("Cleared items collection")
-        else:
-            await db.create_collection("items")
-            logger.info("Created items collection")
-            
-        if "sales" in collections:
-            await db.sales.delete_many({})
-            logger.info("Cleared sales collection")
-        else:
-            await db.create_collection("sales")
-            logger.info("Created sales collection")
-            
-        if "cashflows" in collections:
-            await db.cashflows.delete_many({})
-            logger.info("Cleared cashflows collection")
-        else:
-            await db.create_collection("cashflows")
-            logger.info("Created cashflows collection")
-        
-        # Generate and insert items
-        items_data = generate_items(20)
-        result = await db.items.insert_many(items_data)
-        logger.info(f"Inserted {len(result.inserted_ids)} items")
-        
-        # Fetch inserted items to use their IDs for sales
-        items = await db.items.find().to_list(100)
-        
+        main.db = db
+
+        # Clear existing data, including what the API derives from it. Dropping is far
+        # cheaper than deleting millions of documents; indexes are rebuilt after the load
+        if args.mode == "replace":
+            for name in ("items", "sales", "sales_archive", "cashflows", "cash_snapshots", "sales_monthly", "stats"):
+                await db.drop_collection(name)
+                logger.info(f"Cleared {name} collection")
+
+        rng = random.Random(args.seed)
+        end = args.end_date or datetime.now()
+
+        # Generate and insert items, keeping only what sales need to reference them
+        item_refs = []
+        def tracked(items):
+            for item in items:
+                item_refs.append((str(item["_id"]), item["name"]))
+                yield item
+        start = await db.items.estimated_document_count() + 1
+        await insert_lazily(
+            db.items, tracked(iter_items(args.items, rng, start=start, end=end)),
+            args.items, args.batch_size, args.concurrency
+        )
+        if args.mode == "append":
+            # Sales go to old and new items alike
+            item_refs = [
+                (str(item["_id"]), item["name"])
+                async for item in db.items.find({}, {"name": 1})
+            ]
+
         # Generate and insert sales
-        sales_data = generate_sales(items, 50)
-        result = await db.sales.insert_many(sales_data)
-        logger.info(f"Inserted {len(result.inserted_ids)} sales")
-        
+        if args.sales and not item_refs:
+            logger.warning("No items to sell, skipping sales")
+        elif args.sales:
+            await insert_lazily(
+                db.sales, iter_sales(item_refs, args.sales, rng, days=args.days, zipf=args.zipf, end=end),
+                args.sales, args.batch_size, args.concurrency
+            )
+
         # Generate and insert cash flows
-        cashflow_data = generate_cashflows(40)
-        result = await db.cashflows.insert_many(cashflow_data)
-        logger.info(f"Inserted {len(result.inserted_ids)} cash flows")
-        
+        await insert_lazily(
+            db.cashflows, iter_cashflows(args.cashflows, rng, days=args.days, end=end),
+            args.cashflows, args.batch_size, args.concurrency
+        )
+
+        # Rebuild the data the API derives from sales, items and cash flows
+        await main.ensure_indexes()
+        if args.mode == "append":
+            await main.backfill_low_stock_flags()
+        else:
+            # Generated items carry their flags and search terms already, only record that.
+            # The stats document was dropped with the data: a fresh epoch keeps ETags and
+            # memoized reports from the previous data from matching again
+            await db["stats"].update_one(
+                {"_id": main.STATS_ID},
+                {"$set": {"lowStockFlags": True, "searchTerms": True}, "$setOnInsert": {"epoch": ObjectId()}},
+                upsert=True
+            )
+        # Generated cash flows are dated in the past, which existing snapshots don't cover
+        await main.rebuild_cash_snapshots()
+        await main.reconcile_stats()
+        await main.rebuild_sales_rollup()
+
         logger.info("Database seeding complete!")
-        
+
         # Display some summary statistics
         logger.info("\n--- Database Summary ---")
-        logger.info(f"Items: {await db.items.count_documents({})}")
-        logger.info(f"Sales: {await db.sales.count_documents({})}")
-        logger.info(f"Cash Flows: {await db.cashflows.count_documents({})}")
+        logger.info(f"Items: {await db.items.estimated_document_count()}")
+        logger.info(f"Sales: {await db.sales.estimated_document_count()}")
+        logger.info(f"Cash Flows: {await db.cashflows.estimated_document_count()}")
         logger.info("----------------------\n")
-        
+
         # Display connection string for users
         masked_uri = MONGODB_URI.replace(MONGODB_URI.split('@')[0], "mongodb+srv://[username]:[password]")
         logger.info(f"Your MongoDB is now populated at: {masked_uri}")
         logger.info(f"Database name: {DATABASE_NAME}")
-        
+
     except Exception as e:
         logger.error(f"Error seeding database: {e}")
     finally:
@@ -191,6 +325,21 @@ async def seed_database():
             client.close()
             logger.info("MongoDB connection closed")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Seed the StockFlow database with generated data")
+    parser.add_argument("--items", type=int, default=20, help="items to create (default 20)")
+    parser.add_argument("--sales", type=int, default=50, help="sales to create (default 50)")
+    parser.add_argument("--cashflows", type=int, default=40, help="cash flows to create (default 40)")
+    parser.add_argument("--mode", choices=["replace", "append"], default="replace",
+                        help="replace drops the existing data first, append adds to it")
+    parser.add_argument("--seed", type=int, default=None, help="random seed; the same seed generates the same data")
+    parser.add_argument("--end-date", type=datetime.fromisoformat, default=None,
+                        help="date the generated history ends at (default now); fix it to reproduce a data set exactly")
+    parser.add_argument("--days", type=int, default=180, help="sales and cash flows span this many days back")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of item popularity; 0 is uniform")
+    parser.add_argument("--batch-size", type=int, default=5000, help="documents per insert_many")
+    parser.add_argument("--concurrency", type=int, default=4, help="insert_many batches in flight")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    # Run the async function
-    asyncio.run(seed_database())
+    asyncio.run(seed_database(parse_args()))
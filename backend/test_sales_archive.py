@@ -0,0 +1,68 @@
+"""
+Sales archiver checks against an in-memory MongoDB stand-in (mongomock-motor).
+
+Usage:
+    python -m pytest test_sales_archive.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import main
+
+@pytest.fixture
+def db():
+    main.client = mongomock_motor.AsyncMongoMockClient()
+    main.db = main.analytics_db = main.client["stockflow_test"]
+    asyncio.run(main.db.sales_archive.create_index([("itemId", 1), ("day", 1)], unique=True))
+    return main.db
+
+def old_sales(count):
+    sale_date = datetime.now().replace(microsecond=0) - timedelta(days=10)
+    item_id = str(ObjectId())
+    return [
+        {"_id": ObjectId(), "itemId": item_id, "itemName": "Jeans", "quantity": n + 1, "total": 10.0 * (n + 1), "saleDate": sale_date}
+        for n in range(count)
+    ]
+
+async def archive_state(db):
+    buckets = await db.sales_archive.find().to_list(None)
+    return await db.sales.count_documents({}), buckets
+
+def test_partly_archived_batch_keeps_every_sale(db):
+    """A bucket already holding some of a batch's sales, as left by an interrupted run"""
+    sales = old_sales(3)
+    asyncio.run(db.sales.insert_many(sales))
+    first = sales[0]
+    asyncio.run(db.sales_archive.insert_one({
+        "itemId": first["itemId"], "day": main.sale_day(first["saleDate"]), "itemName": first["itemName"],
+        "lines": [{key: first[key] for key in ("_id", "quantity", "total", "saleDate")}],
+        "count": 1, "quantity": first["quantity"], "total": first["total"]
+    }))
+
+    assert asyncio.run(main.archive_sales(days=1)) == 3
+    hot, buckets = asyncio.run(archive_state(db))
+    assert hot == 0
+    assert len(buckets) == 1
+    assert sorted(line["_id"] for line in buckets[0]["lines"]) == sorted(sale["_id"] for sale in sales)
+    assert buckets[0]["count"] == 3
+    assert buckets[0]["quantity"] == sum(sale["quantity"] for sale in sales)
+    assert buckets[0]["total"] == sum(sale["total"] for sale in sales)
+
+def test_repeated_batch_is_not_counted_twice(db):
+    """Sales archived but still in sales, as after a crash before the delete"""
+    sales = old_sales(4)
+    asyncio.run(db.sales.insert_many(sales))
+    asyncio.run(main.archive_sales(days=1, batch_size=3))
+    asyncio.run(db.sales.insert_many(sales))
+
+    assert asyncio.run(main.archive_sales(days=1, batch_size=2)) == 4
+    hot, buckets = asyncio.run(archive_state(db))
+    assert hot == 0
+    assert buckets[0]["count"] == 4
+    assert len(buckets[0]["lines"]) == 4
@@ -31,6 +31,14 @@ export default function Notifications() {
     };
 
     fetchLowStockItems();
+
+    // Refresh when an item crosses its low stock threshold instead of polling
+    const unsubscribe = api.subscribeToEvents({
+      lowstock: () => {
+        fetchLowStockItems();
+      },
+    });
+    return unsubscribe;
   }, [toast]);
 
   return (
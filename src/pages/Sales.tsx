@@ -6,7 +6,7 @@ import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/com
 import { Input } from '@/components/ui/input';
 import { Button } from '@/components/ui/button';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
-import { Item, Sale } from '@/types';
+import { ItemSuggestion, Sale } from '@/types';
 import { z } from 'zod';
 import { useForm } from 'react-hook-form';
 import { zodResolver } from '@hookform/resolvers/zod';
@@ -25,7 +25,9 @@ type SaleFormValues = z.infer<typeof saleSchema>;
 export default function Sales() {
   const { toast } = useToast();
   const [loading, setLoading] = useState(false);
-  const [items, setItems] = useState<Item[]>([]);
+  const [items, setItems] = useState<ItemSuggestion[]>([]);
+  const [itemSearch, setItemSearch] = useState('');
+  const [selectedItem, setSelectedItem] = useState<ItemSuggestion | null>(null);
   const [recentSales, setRecentSales] = useState<Sale[]>([]);
   const [loadingItems, setLoadingItems] = useState(true);
   const [loadingSales, setLoadingSales] = useState(true);
@@ -39,12 +41,15 @@ export default function Sales() {
     },
   });
 
-  // Fetch items and recent sales on load
+  // Search items as the user types, a moment after the last keystroke
   useEffect(() => {
-    const fetchData = async () => {
+    let cancelled = false;
+    const timer = setTimeout(async () => {
       try {
-        const itemsData = await api.getItems();
-        setItems(itemsData);
+        const itemsData = await api.searchItems(itemSearch);
+        if (!cancelled) {
+          setItems(itemsData);
+        }
       } catch (error) {
         toast({
           title: "Error",
@@ -54,7 +59,16 @@ export default function Sales() {
       } finally {
         setLoadingItems(false);
       }
+    }, 250);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [itemSearch, toast]);
 
+  // Fetch recent sales on load
+  useEffect(() => {
+    const fetchData = async () => {
       try {
         const salesData = await api.getSales();
         setRecentSales(salesData.slice(0, 10).reverse()); // Get last 10 sales
@@ -89,6 +103,7 @@ export default function Sales() {
             : item
         )
       );
+      setSelectedItem(null);
       
       toast({
         title: "Sale Recorded",
@@ -109,11 +124,11 @@ export default function Sales() {
     }
   };
 
-  const selectedItem = form.watch('itemId') 
-    ? items.find(item => item.id === form.watch('itemId'))
-    : null;
-
   const maxQuantity = selectedItem?.quantity || 0;
+  // Keep the chosen item selectable while the search shows other items
+  const options = selectedItem && !items.some(item => item.id === selectedItem.id)
+    ? [selectedItem, ...items]
+    : items;
   
   return (
     <div className="max-w-5xl mx-auto py-6 animate-fade-in space-y-8">
@@ -143,9 +158,17 @@ export default function Sales() {
                     render={({ field }) => (
                       <FormItem>
                         <FormLabel>Select Item</FormLabel>
+                        <Input
+                          placeholder="Search by name or brand"
+                          value={itemSearch}
+                          onChange={e => setItemSearch(e.target.value)}
+                        />
                         <Select
-                          onValueChange={field.onChange}
-                          defaultValue={field.value}
+                          onValueChange={value => {
+                            field.onChange(value);
+                            setSelectedItem(options.find(item => item.id === value) || null);
+                          }}
+                          value={field.value}
                         >
                           <FormControl>
                             <SelectTrigger>
@@ -153,13 +176,13 @@ export default function Sales() {
                             </SelectTrigger>
                           </FormControl>
                           <SelectContent>
-                            {items.map((item) => (
+                            {options.map((item) => (
                               <SelectItem 
                                 key={item.id} 
                                 value={item.id}
                                 disabled={item.quantity === 0}
                               >
-                                {item.name} - {item.brand} ({item.quantity} in stock)
+                                {item.name} ({item.quantity} in stock)
                               </SelectItem>
                             ))}
                           </SelectContent>
@@ -1,5 +1,5 @@
 
-import { Item, Sale, CashFlow, DashboardStats } from '@/types';
+import { Item, ItemSuggestion, Sale, CashFlow, DashboardStats } from '@/types';
 import { mongodb } from './mongodb';
 
 // API base URL - change to your backend URL when deployed
@@ -26,6 +26,28 @@ export const api = {
     }
   },
   
+  // First items matching what was typed, by name; the first items by name when nothing was
+  searchItems: async (q: string, limit = 20): Promise<ItemSuggestion[]> => {
+    const query = q.trim();
+    try {
+      const url = query
+        ? `${API_BASE_URL}/items/typeahead?q=${encodeURIComponent(query)}&limit=${limit}`
+        : `${API_BASE_URL}/items?sort=name&limit=${limit}&fields=id,name,quantity`;
+      const response = await fetch(url);
+      if (!response.ok) {
+        throw new Error(`HTTP error ${response.status}`);
+      }
+      return await response.json();
+    } catch (error) {
+      console.error("Error searching items from API, falling back to mock:", error);
+      const items = await mongodb.getItems();
+      return items
+        .filter(item => `${item.name} ${item.brand}`.toLowerCase().includes(query.toLowerCase()))
+        .slice(0, limit)
+        .map(({ id, name, quantity }) => ({ id, name, quantity }));
+    }
+  },
+  
   addItem: async (item: Omit<Item, 'id' | 'createdAt' | 'updatedAt'>): Promise<Item> => {
     try {
       console.log("Adding item via API:", item);
@@ -161,6 +183,23 @@ export const api = {
     }
   },
   
+  // Live events (server-sent): 'sale', 'cashflow' and 'lowstock'
+  subscribeToEvents: (handlers: Partial<Record<'sale' | 'cashflow' | 'lowstock', (data: any) => void>>): (() => void) => {
+    if (typeof EventSource === 'undefined') {
+      return () => {};
+    }
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    Object.entries(handlers).forEach(([type, handler]) => {
+      source.addEventListener(type, (event) => {
+        handler?.(JSON.parse((event as MessageEvent).data));
+      });
+    });
+    source.onerror = () => {
+      console.error("Event stream error, the browser will reconnect");
+    };
+    return () => source.close();
+  },
+  
   // Monthly Report
   getMonthlyReport: async (): Promise<Item[]> => {
     try {
@@ -10,6 +10,13 @@ export interface Item {
   updatedAt: string;
 }
 
+// Picker entry returned by the item typeahead
+export interface ItemSuggestion {
+  id: string;
+  name: string;
+  quantity: number;
+}
+
 export interface Sale {
   id: string;
   itemId: string;